@@ -0,0 +1,45 @@
+from circuit.circuit import Circuit
+from synthesizers.circuit_synthesizer import CircuitSynthesizer
+from sat.solver import Solver
+from random import randint, sample, seed
+from time import perf_counter
+
+widths = [2, 3, 4]
+gate_count = 6
+samples = 5
+solver_name = "gluecard4"  # supports both clausal and native cardinality constraints
+encodings = ["seqcounter", "sortnetwrk", "cardnetwrk", "totalizer", "mtotalizer",
+             "kmtotalizer", "native"]
+
+seed(0)
+header = ["width", "encoding", "clauses", "atmosts", "build [s]", "solve [s]"]
+print(" ".join(f"{name:>{size}}" for name, size in zip(header, [5, 12, 9, 8, 10, 10])))
+for width in widths:
+    circuits = []
+    for _ in range(samples):
+        circuit = Circuit(width)
+        for _ in range(gate_count):
+            target, *controls = sample(range(width), randint(1, width))
+            circuit.mcx(controls, target)
+        circuits.append(circuit)
+
+    for encoding in encodings:
+        clauses, atmosts, build_time, solve_time = 0, 0, 0.0, 0.0
+        for circuit in circuits:
+            start = perf_counter()
+            synthesizer = CircuitSynthesizer(
+                circuit.tt(), gate_count, Solver(solver_name), cardinality_encoding=encoding
+            )
+            synthesizer.set_global_controls_num(circuit.controls_num())
+            build_time += perf_counter() - start
+            clauses += synthesizer._cnf.clauses_num()
+            atmosts += len(synthesizer._cnf.atmosts())
+
+            start = perf_counter()
+            assert synthesizer.solve() is not None
+            solve_time += perf_counter() - start
+
+        print(
+            f"{width:>5} {encoding:>12} {clauses // samples:>9} {atmosts // samples:>8} "
+            f"{build_time / samples:>10.4f} {solve_time / samples:>10.4f}"
+        )
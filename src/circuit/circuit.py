@@ -1,31 +1,78 @@
 from qiskit import QuantumCircuit
-from copy import copy, deepcopy
+from copy import copy
+from array import array
 from itertools import permutations, combinations
-from functools import reduce
 from truth_table.truth_table import TruthTable
 from utils.inplace import inplace
 from collections import deque
 
 
 Gate = tuple[list[int], int]  # Gate in integer representation
+PackedGate = int  # Gate as (controls bitmask << TARGET_BITS) | target
+CircuitKey = tuple[int, tuple[PackedGate, ...]]
+
+TARGET_BITS = 5
+TARGET_MASK = (1 << TARGET_BITS) - 1
+MAX_WIDTH = 1 << TARGET_BITS
+
+
+def gates_typecode(width: int) -> str:
+    assert 0 <= width and width <= MAX_WIDTH
+    return "H" if width + TARGET_BITS <= 16 else "Q"
+
+
+def pack_gate(gate: Gate) -> PackedGate:
+    controls, target = gate
+    mask = 0
+    for control in controls:
+        mask |= 1 << control
+    return (mask << TARGET_BITS) | target
+
+
+def unpack_gate(packed: PackedGate) -> Gate:
+    mask = packed >> TARGET_BITS
+    controls = [i for i in range(mask.bit_length()) if mask >> i & 1]
+    return (controls, packed & TARGET_MASK)
+
+
+def permute_mask(mask: int, permutation: list[int]) -> int:
+    new_mask = 0
+    for i, new_i in enumerate(permutation):
+        if mask >> i & 1:
+            new_mask |= 1 << new_i
+    return new_mask
+
+
+def gates_commute(lhs: PackedGate, rhs: PackedGate) -> bool:
+    lhs_collision = (rhs >> TARGET_BITS) >> (lhs & TARGET_MASK) & 1
+    rhs_collision = (lhs >> TARGET_BITS) >> (rhs & TARGET_MASK) & 1
+    return not lhs_collision and not rhs_collision
 
 
 class Circuit:
+    __slots__ = ("_width", "_tt", "_gates", "_exclusion_list")
+
     def __init__(self, bits_num: int):
         self._width = bits_num
         self._tt: TruthTable | None = None
-        self._gates: list[Gate] = []
+        self._gates: array = array(gates_typecode(bits_num))
         self._exclusion_list: None | list[int] = None
 
+    @classmethod
+    def from_packed(cls, bits_num: int, packed_gates) -> "Circuit":
+        new = cls(bits_num)
+        new._gates.extend(packed_gates)
+        return new
+
     def __copy__(self) -> "Circuit":
         new = Circuit(self._width)
         new._tt = copy(self._tt)
-        new._gates = deepcopy(self._gates)
+        new._gates = self._gates[:]
         return new
 
     def __str__(self) -> str:
         qc = QuantumCircuit(self._width)
-        for controls, target in self._gates:
+        for controls, target in self.gates():
             if len(controls) == 0:
                 qc.x(target)
             else:
@@ -39,6 +86,9 @@ class Circuit:
     def __eq__(self, other) -> bool:
         return (self._width, self._gates) == (other._width, other._gates)
 
+    def __hash__(self) -> int:
+        return hash(self.key())
+
     def __add__(self, other: "Circuit") -> "Circuit":
         assert self._width == other._width
         new_width = self._width
@@ -47,34 +97,36 @@ class Circuit:
         return new_circuit
 
     def __getitem__(self, key: int) -> Gate:
-        return self._gates[key]
+        return unpack_gate(self._gates[key])
 
     def width(self) -> int:
         return self._width
 
+    def key(self) -> CircuitKey:
+        return (self._width, tuple(self._gates))
+
     def tt(self) -> TruthTable:
         if self._tt is None:
             self._tt = TruthTable(self._width)
-            for controls, target in self._gates:
+            for controls, target in self.gates():
                 self._tt.mcx(controls, target)
         return self._tt
 
     def gates(self) -> list[Gate]:
+        return [unpack_gate(packed) for packed in self._gates]
+
+    def packed_gates(self) -> array:
         return self._gates
 
     def controls_num(self) -> int:
-        return reduce(lambda x, y: x + len(y[0]), self._gates, 0)
+        return sum((packed >> TARGET_BITS).bit_count() for packed in self._gates)
 
     def gate_swappable(self, index: int, ignore_identical: bool = True) -> bool:
         lhs = self._gates[index]
         rhs = self._gates[(index + 1) % len(self)]
         if ignore_identical and lhs == rhs:
             return False
-        lhs_controls, lhs_target = lhs
-        rhs_controls, rhs_target = rhs
-        lhs_collision = lhs_target in rhs_controls
-        rhs_collision = rhs_target in lhs_controls
-        return not (lhs_collision) and not (rhs_collision)
+        return gates_commute(lhs, rhs)
 
     def swappable_gates(self, ignore_identical: bool = True) -> list[int]:
         indices = [
@@ -97,12 +149,15 @@ class Circuit:
 
     @classmethod
     def filter_duplicates(cls, unfiltered: list["Circuit"]) -> list["Circuit"]:
-        return [circ for i, circ in enumerate(unfiltered) if circ not in unfiltered[:i]]
+        unique: dict[CircuitKey, "Circuit"] = {}
+        for circ in unfiltered:
+            unique.setdefault(circ.key(), circ)
+        return list(unique.values())
 
     @inplace
     def x(self, target: int, **_) -> "Circuit":
         assert 0 <= target and target < self._width
-        self._gates.append(([], target))
+        self._gates.append(target)
         self._tt = None
         return self
 
@@ -110,7 +165,7 @@ class Circuit:
     def cx(self, control: int, target: int, **_) -> "Circuit":
         assert 0 <= target and target < self._width
         assert 0 <= control and control < self._width
-        self._gates.append(([control], target))
+        self._gates.append((1 << control << TARGET_BITS) | target)
         self._tt = None
         return self
 
@@ -118,8 +173,7 @@ class Circuit:
     def mcx(self, controls: list[int], target: int, **_) -> "Circuit":
         assert 0 <= target and target < self._width
         assert all([0 <= cid and cid < self._width for cid in controls])
-        controls = sorted(controls)
-        self._gates.append((controls, target))
+        self._gates.append(pack_gate((controls, target)))
         self._tt = None
         return self
 
@@ -138,33 +192,30 @@ class Circuit:
 
     def reverse(self) -> "Circuit":
         new = Circuit(self._width)
-        new._gates = deepcopy(self._gates)
-        new._gates.reverse()
+        new._gates = self._gates[::-1]
         return new
 
     def rotate(self, shift: int) -> "Circuit":
         size = len(self)
         shift = (shift % size) + size % size
         new = Circuit(self._width)
-        new._gates = deepcopy(self._gates)
-        new._gates = new._gates[shift:] + new._gates[:shift]
+        new._gates = self._gates[shift:] + self._gates[:shift]
         return new
 
     def permute(self, permutation: list[int]) -> "Circuit":
-        new_gates: list[Gate] = []
-        for controls, target in self._gates:
-            new_target = permutation[target]
-            new_controls = sorted([permutation[c] for c in controls])
-            new_gates.append((new_controls, new_target))
         new = Circuit(self._width)
-        new._gates = new_gates
+        new_gates = new._gates
+        for packed in self._gates:
+            new_target = permutation[packed & TARGET_MASK]
+            new_mask = permute_mask(packed >> TARGET_BITS, permutation)
+            new_gates.append((new_mask << TARGET_BITS) | new_target)
         return new
 
     def swap(self, id: int) -> "Circuit":
         assert 0 <= id and id < len(self)
         next_id = (id + 1) % len(self)
         new = Circuit(self._width)
-        new._gates = deepcopy(self._gates)
+        new._gates = self._gates[:]
         new._gates[id], new._gates[next_id] = new._gates[next_id], new._gates[id]
         return new
 
@@ -177,21 +228,22 @@ class Circuit:
         return self.slice(0, len(self) // 2 + 1)
 
     def add_empty_line(self, line_id: int) -> "Circuit":
-        assert 0 <= line_id and line_id <= self._width
-        new = Circuit(self._width + 1)
-        for controls, target in self._gates:
-            new_target = target if line_id > target else target + 1
-            new_controls = [(c if line_id > c else c + 1) for c in controls]
-            new.mcx(new_controls, new_target)
-        return new
+        return self._add_line(line_id, full=False)
 
     def add_full_line(self, line_id: int) -> "Circuit":
+        return self._add_line(line_id, full=True)
+
+    def _add_line(self, line_id: int, full: bool) -> "Circuit":
         assert 0 <= line_id and line_id <= self._width
         new = Circuit(self._width + 1)
-        for controls, target in self._gates:
+        low_bits = (1 << line_id) - 1
+        line_bit = int(full) << line_id
+        for packed in self._gates:
+            target = packed & TARGET_MASK
             new_target = target if line_id > target else target + 1
-            new_controls = [(c if line_id > c else c + 1) for c in controls] + [line_id]
-            new.mcx(new_controls, new_target)
+            mask = packed >> TARGET_BITS
+            new_mask = (mask & low_bits) | ((mask & ~low_bits) << 1) | line_bit
+            new._gates.append((new_mask << TARGET_BITS) | new_target)
         return new
 
     def rotations(self) -> list["Circuit"]:
@@ -211,20 +263,22 @@ class Circuit:
         unique = self.filter_duplicates(equivalents)
         return unique
 
-    def _dfs(self, visited: list["Circuit"]):
+    def _dfs(self, visited: list["Circuit"], seen: set[CircuitKey]):
         visited.append(self)
+        seen.add(self.key())
         neighbours = self.swaps()
         for node in neighbours:
-            if node not in visited:
-                node._dfs(visited)
+            if node.key() not in seen:
+                node._dfs(visited, seen)
 
     def swap_space_dfs(self) -> list["Circuit"]:
-        nodes = []
-        self._dfs(nodes)
+        nodes: list["Circuit"] = []
+        self._dfs(nodes, set())
         return nodes
 
     def swap_space_bfs(self, initial: list["Circuit"] = []) -> list["Circuit"]:
         visited: list["Circuit"] = []
+        seen: set[CircuitKey] = set()
         queue: deque["Circuit"] = deque()
         queue.append(self)
         for other in initial:
@@ -232,13 +286,24 @@ class Circuit:
                 queue.append(other)
         while queue:
             curr = queue.popleft()
-            if curr not in visited:
+            curr_key = curr.key()
+            if curr_key not in seen:
                 visited.append(curr)
+                seen.add(curr_key)
                 for neighbor in curr.swaps():
-                    if neighbor not in visited:
+                    if neighbor.key() not in seen:
                         queue.append(neighbor)
         return visited
 
+    def canonical(self) -> "Circuit":
+        search = _CanonicalSearch(self._width, self._gates.tolist())
+        search.run()
+        assert search.best is not None
+        return Circuit.from_packed(self._width, search.best)
+
+    def canonical_key(self) -> CircuitKey:
+        return self.canonical().key()
+
     def local_unroll(self) -> list["Circuit"]:
         equivalents = self.rotations()
         temp_list = [circuit.reverse() for circuit in equivalents]
@@ -291,3 +356,159 @@ class Circuit:
                 new = new.add_full_line(line_id)
             extensions.append(new)
         return extensions
+
+
+# fixed gates mask, masks of the dependent gates placed before every gate
+Trace = tuple[int, tuple[int, ...]]
+
+
+class _CanonicalSearch:
+    # Branch and bound over the gate orders and line relabelings of a circuit class.
+    # Gate orders equal up to swaps of commuting gates form one trace. Gates commuting
+    # with the whole fixed prefix may wrap around the remaining ones, which covers
+    # rotations and cyclic swaps. Only choices giving the smallest next gate are expanded.
+    def __init__(self, width: int, gates: list[PackedGate]):
+        self._gates = gates
+        self._dependent = [
+            sum(1 << j for j, other in enumerate(gates) if not gates_commute(gate, other))
+            for gate in gates
+        ]
+        self._mapping = [-1] * width
+        self.best: list[PackedGate] | None = None
+
+    def run(self) -> None:
+        # every gate can start a rotation, so the first choices come without a closure
+        size = len(self._gates)
+        options: dict[PackedGate, set[Trace]] = {}
+        for first in range(size):
+            for direction in (1, -1):
+                position = [(gid - first) * direction % size for gid in range(size)]
+                before = tuple(
+                    sum(1 << j for j in range(size) if dep >> j & 1 and position[j] < position[i])
+                    for i, dep in enumerate(self._dependent)
+                )
+                trace = self._remove(((1 << size) - 1, before), first)
+                options.setdefault(self._gates[first], set()).add(trace)
+        self._expand(options, set(self._gates), [], list(range(len(self._mapping))))
+
+    def _firsts(self, trace: Trace) -> list[int]:
+        remaining, before = trace
+        return [i for i in range(len(before)) if remaining >> i & 1 and not before[i]]
+
+    def _lasts(self, trace: Trace) -> list[int]:
+        remaining, before = trace
+        after = 0
+        for dep in before:
+            after |= dep
+        return [i for i in range(len(before)) if remaining >> i & 1 and not after >> i & 1]
+
+    def _remove(self, trace: Trace, gid: int) -> Trace:
+        remaining, before = trace
+        remaining &= ~(1 << gid)
+        return remaining, tuple(dep & remaining if i != gid else 0 for i, dep in enumerate(before))
+
+    def _to_back(self, trace: Trace, gid: int) -> Trace:
+        remaining, before = self._remove(trace, gid)
+        moved = list(before)
+        moved[gid] = self._dependent[gid] & remaining
+        return trace[0], tuple(moved)
+
+    def _to_front(self, trace: Trace, gid: int) -> Trace:
+        remaining, before = trace
+        dependent = self._dependent[gid] & remaining
+        moved = [dep | 1 << gid if dependent >> i & 1 else dep for i, dep in enumerate(before)]
+        moved[gid] = 0
+        return remaining, tuple(moved)
+
+    def _closure(self, traces: set[Trace], free: set[PackedGate]) -> set[Trace]:
+        queue = list(traces)
+        while queue:
+            trace = queue.pop()
+            moves = [self._to_back(trace, i) for i in self._firsts(trace)
+                     if self._gates[i] in free]
+            moves += [self._to_front(trace, i) for i in self._lasts(trace)
+                      if self._gates[i] in free]
+            for moved in moves:
+                if moved not in traces:
+                    traces.add(moved)
+                    queue.append(moved)
+        return traces
+
+    def _options(self, traces: set[Trace]) -> dict[PackedGate, set[Trace]]:
+        options: dict[PackedGate, set[Trace]] = {}
+        for trace in traces:
+            placed: set[PackedGate] = set()
+            for i in self._firsts(trace):
+                if self._gates[i] not in placed:  # equal gates leave equal rests
+                    placed.add(self._gates[i])
+                    options.setdefault(self._gates[i], set()).add(self._remove(trace, i))
+        return options
+
+    def _search(
+        self,
+        traces: set[Trace],
+        free: set[PackedGate],
+        relabeled: list[PackedGate],
+        labels: list[int],
+    ) -> None:
+        if any(not remaining for remaining, _ in traces):
+            if self.best is None or relabeled < self.best:
+                self.best = relabeled[:]
+            return
+        self._expand(self._options(traces), free, relabeled, labels)
+
+    def _expand(
+        self,
+        options: dict[PackedGate, set[Trace]],
+        free: set[PackedGate],
+        relabeled: list[PackedGate],
+        labels: list[int],
+    ) -> None:
+        if not options:
+            self.best = []
+            return
+        values = {gate: self._relabel(gate, labels) for gate in options}
+        value = min(values.values())
+        relabeled.append(value)
+        if self.best is None or relabeled <= self.best[:len(relabeled)]:
+            for gate, children in options.items():
+                if values[gate] == value:
+                    self._branch(gate, children, free, relabeled, labels)
+        relabeled.pop()
+
+    def _relabel(self, gate: PackedGate, labels: list[int]) -> PackedGate:
+        mapping = self._mapping
+        controls = [i for i in range(len(mapping)) if gate >> TARGET_BITS >> i & 1]
+        unmapped = sum(mapping[c] < 0 for c in controls)
+        mask = sum(1 << mapping[c] for c in controls if mapping[c] >= 0)
+        mask += sum(1 << label for label in labels[:unmapped])
+        target = gate & TARGET_MASK
+        label = mapping[target] if mapping[target] >= 0 else labels[unmapped]
+        return (mask << TARGET_BITS) | label
+
+    def _branch(
+        self,
+        gate: PackedGate,
+        children: set[Trace],
+        free: set[PackedGate],
+        relabeled: list[PackedGate],
+        labels: list[int],
+    ) -> None:
+        mapping = self._mapping
+        controls = [i for i in range(len(mapping)) if gate >> TARGET_BITS >> i & 1]
+        unmapped = [c for c in controls if mapping[c] < 0]
+        new_labels, rest = labels[:len(unmapped)], labels[len(unmapped):]
+        target = gate & TARGET_MASK
+        target_unmapped = mapping[target] < 0
+        if target_unmapped:
+            mapping[target], rest = rest[0], rest[1:]
+        free = {other for other in free if gates_commute(gate, other)}
+        children = self._closure(children, free)
+        for permutation in permutations(new_labels):
+            for control, label in zip(unmapped, permutation):
+                mapping[control] = label
+            self._search(children, free, relabeled, rest)
+        for control in unmapped:
+            mapping[control] = -1
+        if target_unmapped:
+            mapping[target] = -1
@@ -1,7 +1,14 @@
 import pytest
 from random import randint, sample, shuffle
 from copy import copy
-from circuit.circuit import Circuit, Gate, TruthTable
+from circuit.circuit import Circuit, Gate, TruthTable, pack_gate, unpack_gate
+from circuit.collection import Collection
+from circuit.dim_group import DimGroup
+from circuit.tt_index import TruthTableIndex
+from utils.dump import collection_dump, collection_dump_bin, collection_dump_str
+from utils.dump import dimgroup_dump_bin
+from utils.load import MappedCollection, dimgroup_load_bin
+from utils.shards import ShardStore
 
 
 max_bits_num = 5
@@ -303,3 +310,138 @@ def test_unroll():
     swap_space = circuit.unroll()
     assert len(swap_space) == 60
     assert circuit in swap_space
+
+
+@pytest.mark.parametrize("bits_num", bits_num_randomizer)
+def test_key(random_circuit):
+    same = copy(random_circuit)
+    assert same.key() == random_circuit.key()
+    assert hash(same) == hash(random_circuit)
+    same.x(0)
+    assert same.key() != random_circuit.key()
+    equivalents = random_circuit.permutations() + random_circuit.permutations()
+    unique = Circuit.filter_duplicates(equivalents)
+    assert len(unique) == len(set(equivalents))
+    assert unique == [circ for i, circ in enumerate(equivalents) if circ not in equivalents[:i]]
+
+
+@pytest.mark.parametrize("bits_num", bits_num_randomizer)
+def test_packed_gates(random_circuit):
+    for gate in random_circuit.gates():
+        assert unpack_gate(pack_gate(gate)) == gate
+    packed = random_circuit.packed_gates()
+    assert len(packed) == len(random_circuit)
+    recreated = Circuit.from_packed(random_circuit.width(), packed)
+    assert recreated == random_circuit
+    assert recreated.gates() == random_circuit.gates()
+
+
+@pytest.mark.parametrize("bits_num", bits_num_randomizer)
+def test_add_lines(random_circuit):
+    width = random_circuit.width()
+    line_id = randint(0, width)
+    empty = random_circuit.add_empty_line(line_id)
+    full = random_circuit.add_full_line(line_id)
+    for (controls, target), (e_controls, e_target), (f_controls, f_target) in zip(
+        random_circuit, empty, full
+    ):
+        shifted = [c if c < line_id else c + 1 for c in controls]
+        assert e_target == f_target == (target if target < line_id else target + 1)
+        assert e_controls == shifted
+        assert f_controls == sorted(shifted + [line_id])
+
+
+@pytest.mark.parametrize("bits_num", [randint(2, 4) for _ in range(epochs)])
+def test_tt_index(random_circuit):
+    width = random_circuit.width()
+    gate_count = len(random_circuit)
+    collection = Collection(width, gate_count)
+    collection[width][gate_count].extend(random_circuit.rotations())
+    index = TruthTableIndex().add_collection(collection)
+    assert TruthTable(width) in index
+    for rotation in random_circuit.rotations():
+        for k in range(gate_count + 1):
+            prefix = rotation.slice(0, k)
+            found = index.get(prefix.tt())
+            assert found is not None
+            assert len(found) <= k
+            assert found.tt() == prefix.tt()
+
+
+@pytest.mark.parametrize("bits_num", bits_num_randomizer)
+def test_canonical(random_circuit, random_permutations):
+    permutation, _ = random_permutations
+    unrolled = random_circuit.unroll()
+    canonical = random_circuit.canonical()
+    assert canonical in unrolled
+    assert canonical.key() == min(circ.key() for circ in unrolled)
+    shift = randint(0, len(random_circuit) - 1)
+    equivalent = random_circuit.permute(permutation).rotate(shift).reverse()
+    assert equivalent.canonical() == canonical
+    assert equivalent.canonical_key() == canonical.key()
+
+
+@pytest.mark.parametrize("bits_num", [randint(2, 4) for _ in range(epochs // 4)])
+def test_dimgroup_canonicalize(random_circuit):
+    collection = Collection(random_circuit.width(), len(random_circuit))
+    dimgroup = collection[random_circuit.width()][len(random_circuit)]
+    dimgroup.extend(random_circuit.unroll())
+    unrolled_len = len(dimgroup)
+    collection.canonicalize()
+    assert len(dimgroup) == 1
+    assert dimgroup[0] == random_circuit.canonical()
+    collection.expand()
+    assert len(dimgroup) == unrolled_len
+
+
+@pytest.mark.parametrize("bits_num", [randint(2, 4) for _ in range(epochs // 4)])
+def test_collection_bin(random_circuit, tmp_path):
+    width = random_circuit.width()
+    gate_count = len(random_circuit)
+    collection = Collection(width, gate_count)
+    collection[width][gate_count].extend(random_circuit.rotations())
+    collection[width][0].append(Circuit(width))
+    file_name = str(tmp_path / "collection.bin")
+    collection_dump_bin(collection, file_name)
+    with MappedCollection(file_name) as mapped:
+        assert len(mapped) == len(collection)
+        for w in range(width + 1):
+            for gc in range(gate_count + 1):
+                assert list(mapped[w][gc]) == list(collection[w][gc])
+        assert mapped[width][gate_count][-1] == random_circuit.rotations()[-1]
+        loaded = mapped.to_collection()
+    assert str(loaded) == str(collection)
+
+
+@pytest.mark.parametrize("bits_num", [randint(2, 4) for _ in range(epochs // 4)])
+def test_dimgroup_shards(random_circuit, tmp_path):
+    width = random_circuit.width()
+    gate_count = len(random_circuit)
+    dimgroup = DimGroup(width, gate_count)
+    dimgroup.extend(random_circuit.rotations())
+    file_name = str(tmp_path / "dimgroup.bin")
+    dimgroup_dump_bin(dimgroup, file_name)
+    assert list(dimgroup_load_bin(file_name)) == list(dimgroup)
+
+    store = ShardStore(str(tmp_path), "shards")
+    assert (width, gate_count) not in store
+    store.save(dimgroup)
+    reopened = ShardStore(str(tmp_path), "shards")
+    assert list(reopened.load(width, gate_count)) == list(dimgroup)
+    with open(reopened.shard_path(width, gate_count), "r+b") as file:
+        file.truncate(file.seek(0, 2) - 1)
+    assert (width, gate_count) not in reopened
+
+
+@pytest.mark.parametrize("bits_num", [randint(2, 4) for _ in range(epochs // 4)])
+@pytest.mark.parametrize("suffix", ["txt", "txt.gz"])
+def test_collection_text(random_circuit, suffix, tmp_path):
+    width = random_circuit.width()
+    gate_count = len(random_circuit)
+    collection = Collection(width, gate_count)
+    collection[width][gate_count].extend(random_circuit.rotations())
+    file_name = str(tmp_path / f"collection.{suffix}")
+    collection_dump(collection, file_name)
+    loaded = Collection(width, gate_count).from_file(file_name)
+    assert list(loaded[width][gate_count]) == random_circuit.rotations()
+    assert collection_dump_str(loaded) == collection_dump_str(collection)
@@ -1,5 +1,5 @@
 from circuit.dim_group import DimGroup
-from circuit.circuit import Circuit
+from utils.stream import open_text, read_circuits
 from itertools import product
 from copy import copy
 
@@ -53,6 +53,18 @@ class Collection:
             self[width][gc].remove_duplicates()
         return self
 
+    def canonicalize(self) -> "Collection":
+        for width, gc in copy(self._group_ids_iter):
+            print(f"  -- CAN({width}, {gc})")
+            self[width][gc].canonicalize()
+        return self
+
+    def expand(self) -> "Collection":
+        for width, gc in copy(self._group_ids_iter):
+            print(f"  -- EXP({width}, {gc})")
+            self[width][gc].expand()
+        return self
+
     def _empty_line_extensions(self) -> "Collection":
         extensions = Collection(self._max_width, self._max_gate_count)
         for width, gc in copy(self._group_ids_iter):
@@ -87,24 +99,7 @@ class Collection:
             self[width][gc].join(other[width][gc])
 
     def from_file(self, file_name: str):
-        with open(file_name, 'r') as file:
-            for line in file:
-                match line.strip().split(' '):
-                    case ["h", max_width, max_gc]:
-                        assert int(max_width) == self._max_width
-                        assert int(max_gc) == self._max_gate_count
-                    case ["c", width, gc]:
-                        width = int(width)
-                        gc = int(gc)
-                        assert width <= self._max_width
-                        assert gc <= self._max_gate_count
-                        circuit = Circuit(width)
-                        for _ in range(gc):
-                            target, *controls = file.readline().strip().split(' ')
-                            circuit.mcx([int(c) for c in controls], int(target))
-                        self[width][gc].append(circuit)
-                    case ['']:
-                        pass
-                    case _:
-                        pass
+        with open_text(file_name, "r") as file:
+            for circuit in read_circuits(file, self._max_width, self._max_gate_count):
+                self[circuit.width()][len(circuit)].append(circuit)
         return self
@@ -1,4 +1,4 @@
-from circuit.circuit import Circuit
+from circuit.circuit import Circuit, CircuitKey
 
 
 class DimGroup:
@@ -48,3 +48,16 @@ class DimGroup:
 
     def remove_duplicates(self):
         self._circuits = Circuit.filter_duplicates(self._circuits)
+
+    def canonicalize(self):
+        representatives: dict[CircuitKey, Circuit] = {}
+        for circ in self._circuits:
+            canonical = circ.canonical()
+            representatives.setdefault(canonical.key(), canonical)
+        self._circuits = list(representatives.values())
+
+    def expand(self):
+        expanded: list[Circuit] = []
+        for circ in self._circuits:
+            expanded += circ.unroll()
+        self._circuits = Circuit.filter_duplicates(expanded)
@@ -0,0 +1,102 @@
+from circuit.circuit import Circuit
+from circuit.collection import Collection
+from truth_table.truth_table import TruthTable
+from itertools import permutations
+
+TruthTableKey = tuple[int, int]
+Variant = tuple[list[int], bool]  # line permutation, inversion
+
+
+def canonical_variant(tt: TruthTable) -> tuple[TruthTable, Variant]:
+    best: tuple[TruthTable, Variant] | None = None
+    for permutation in permutations(range(tt.bits_num())):
+        for inverse in (False, True) if tt.complete() else (False,):
+            variant = tt.permute(list(permutation), inplace=False)
+            if inverse:
+                variant.inverse()
+            if best is None or variant.key() < best[0].key():
+                best = (variant, (list(permutation), inverse))
+    assert best is not None
+    return best
+
+
+def restore_variant(circuit: Circuit, variant: Variant) -> Circuit:
+    permutation, inverse = variant
+    if inverse:
+        circuit = circuit.reverse()
+    inv_permutation = [0] * len(permutation)
+    for i, p in enumerate(permutation):
+        inv_permutation[p] = i
+    return circuit.permute(inv_permutation)
+
+
+class TruthTableIndex:
+    def __init__(self, max_width: int = 4):
+        self._max_width = max_width
+        self._entries: dict[TruthTableKey, tuple[Circuit, int]] = {}
+
+    def __len__(self) -> int:
+        return len(self._entries)
+
+    def __contains__(self, tt: TruthTable) -> bool:
+        return tt.key() in self._entries
+
+    def _insert(self, key: TruthTableKey, circuit: Circuit, gate_count: int) -> bool:
+        entry = self._entries.get(key)
+        if entry is not None and entry[1] <= gate_count:
+            return False
+        self._entries[key] = (circuit, gate_count)
+        return True
+
+    def add(self, circuit: Circuit) -> bool:
+        if circuit.width() > self._max_width:
+            return False
+        return self._insert(circuit.tt().key(), circuit, len(circuit))
+
+    def add_prefixes(self, circuit: Circuit) -> "TruthTableIndex":
+        if circuit.width() > self._max_width:
+            return self
+        tt = TruthTable(circuit.width())
+        self._insert(tt.key(), circuit, 0)
+        for gate_count, (controls, target) in enumerate(circuit, 1):
+            tt.mcx(controls, target)
+            self._insert(tt.key(), circuit, gate_count)
+        return self
+
+    def add_collection(self, collection: Collection) -> "TruthTableIndex":
+        for width in range(min(len(collection), self._max_width + 1)):
+            for dimgroup in collection[width]:
+                for circuit in dimgroup:
+                    self.add_prefixes(circuit)
+        return self
+
+    def get(self, tt: TruthTable) -> Circuit | None:
+        entry = self._entries.get(tt.key())
+        if entry is None:
+            return None
+        circuit, gate_count = entry
+        return circuit.slice(0, gate_count)
+
+    def lookup(self, tt: TruthTable) -> Circuit | None:
+        if tt.bits_num() > self._max_width:
+            return None
+        best = self.get(tt)
+        if best is not None or not tt.complete():
+            return best
+        for permutation in permutations(range(tt.bits_num())):
+            for inverse in (False, True):
+                circuit = self._lookup_variant(tt, list(permutation), inverse)
+                if circuit is not None and (best is None or len(circuit) < len(best)):
+                    best = circuit
+        return best
+
+    def _lookup_variant(
+        self, tt: TruthTable, permutation: list[int], inverse: bool
+    ) -> Circuit | None:
+        variant = tt.permute(permutation, inplace=False)
+        if inverse:
+            variant.inverse()
+        circuit = self.get(variant)
+        if circuit is None:
+            return None
+        return restore_variant(circuit, (permutation, inverse))
@@ -1,8 +1,10 @@
 from truth_table.truth_table import TruthTable
 from synthesizers.optimal_synthesizer import OptimalSynthesizer
 from sat.solver import Solver
+from sat.portfolio import PortfolioSolver
 from tqdm import tqdm
 from random import shuffle
+from multiprocessing import cpu_count
 
 bits = 4
 
@@ -15,17 +17,15 @@ for i in range(10):
     inputs.append(input_table[:])
 
 
-solvers = ["minisat-gh", "kissat"]
+solvers = [Solver("minisat-gh"), Solver("kissat"), PortfolioSolver(["minisat-gh", "kissat"])]
 
-for s in solvers:
-    solver = Solver(s)
+for solver in solvers:
     histogram = [0] * (max_gc + 1)
     fails = 0
 
-    for permutation in tqdm(inputs):
-        tt = TruthTable(bits, list(permutation))
-        os = OptimalSynthesizer(tt, 0, max_gc, solver)
-        qc = os.solve()
+    tables = [TruthTable(bits, list(permutation)) for permutation in inputs]
+    results = OptimalSynthesizer.solve_many(tables, 0, max_gc, solver, cpu_count())
+    for _, qc in tqdm(results, total=len(tables)):
         if qc is not None:
             qc_size = len(qc)
             histogram[qc_size] += 1
@@ -1,9 +1,53 @@
-from collections.abc import Iterable
-from pysat.formula import CNF as CNF_core, IDPool
-from pysat.card import CardEnc
+from array import array
+from collections.abc import Iterable, Iterator
+from io import BytesIO
+from typing import BinaryIO
+from pysat.formula import IDPool
+from pysat.card import CardEnc, EncType
 from itertools import product
+from math import prod
+from functools import cache
+
+Solution = tuple[bool | None, list[int]]  # None: unknown within the limits
+
+DIMACS_CHUNK = 1 << 16  # clauses serialized per write
+DIMACS_BUFFER_SIZE = 1 << 20
+
+
+XOR_ENCODINGS = ("direct", "chain", "native")
+CARDINALITY_ENCODINGS = {
+    "pairwise": EncType.pairwise,
+    "seqcounter": EncType.seqcounter,
+    "sortnetwrk": EncType.sortnetwrk,
+    "cardnetwrk": EncType.cardnetwrk,
+    "bitwise": EncType.bitwise,
+    "ladder": EncType.ladder,
+    "totalizer": EncType.totalizer,
+    "mtotalizer": EncType.mtotalizer,
+    "kmtotalizer": EncType.kmtotalizer,
+    "native": EncType.native,
+}
+
+
+def dimacs_chunk(literals: Iterable[int], prefix: str = "") -> bytes:
+    lines = []
+    clause: list[str] = []
+    for lit in literals:
+        if lit:
+            clause.append(str(lit))
+        else:
+            clause.append("0\n")
+            lines.append(prefix + " ".join(clause))
+            clause = []
+    return "".join(lines).encode()
+
 
-Solution = tuple[bool, list[int]]
+@cache
+def even_parity_signs(length: int) -> list[tuple[int, ...]]:
+    return [
+        signs for signs in product((1, -1), repeat=length)
+        if (sum(signs) - length + 2) % 4 == 0
+    ]
 
 
 class Literal:
@@ -40,41 +84,138 @@ class Literal:
 
 
 class CNF():
-    def __init__(self):
-        self._cnf = CNF_core()
+    def __init__(self, xor_encoding: str = "direct", cardinality_encoding: str = "seqcounter"):
+        if xor_encoding not in XOR_ENCODINGS:
+            raise ValueError(f"XOR encoding {xor_encoding} not supported")
+        if cardinality_encoding not in CARDINALITY_ENCODINGS:
+            raise ValueError(f"Cardinality encoding {cardinality_encoding} not supported")
+        self._literals = array("i")  # zero-terminated clauses
+        self._offsets = array("q", [0])  # clause k spans offsets[k]:offsets[k + 1]
+        self._xors = array("i")  # zero-terminated native XOR constraints
+        self._xor_encoding = xor_encoding
         self._v_pool = IDPool(start_from=1)
+        self._blocks: dict[str, tuple[int, tuple[int, ...]]] = {}  # name -> (base id, shape)
         self._max_clause_len = 3
-        self._caridnality_enc = 1
+        self._cardinality_encoding = cardinality_encoding
+        self._atmosts: list[tuple[list[int], int]] = []  # native cardinality constraints
         self._v_counter = 0
 
+    def __copy__(self) -> "CNF":
+        new = CNF.__new__(CNF)
+        new.__dict__.update(self.__dict__)
+        new._literals = self._literals[:]
+        new._offsets = self._offsets[:]
+        new._xors = self._xors[:]
+        new._atmosts = self._atmosts[:]
+        new._blocks = dict(self._blocks)
+        new._v_pool = IDPool(start_from=self._v_pool.top + 1,
+                             occupied=[interval[:] for interval in self._v_pool._occupied])
+        new._v_pool.obj2id.update(self._v_pool.obj2id)
+        new._v_pool.id2obj.update(self._v_pool.id2obj)
+        return new
+
     def __str__(self) -> str:
         clauses = self.clauses()
         string = "clauses:\n" + \
             "\n".join([str(clause) for clause in clauses]) + "\n\n"
         string += "literals:\n" + \
-            "\n".join([f"{name}: {value}" for name,
-                      value in self._v_pool.obj2id.items()]) + "\n"
+            "\n".join([f"{name}: {value}" for name, value in self.named_ids()]) + "\n"
         return string
 
-    def clauses(self) -> list[list]:
-        return self._cnf.clauses
+    def clauses(self) -> list[list[int]]:
+        return [clause.tolist() for clause in self.iter_clauses()]
+
+    def clauses_num(self) -> int:
+        return len(self._offsets) - 1
+
+    def literals(self) -> array:
+        return self._literals
+
+    def xor_encoding(self) -> str:
+        return self._xor_encoding
+
+    def cardinality_encoding(self) -> str:
+        return self._cardinality_encoding
+
+    def atmosts(self) -> list[tuple[list[int], int]]:
+        return self._atmosts
+
+    def xors(self) -> list[list[int]]:
+        text = " ".join(map(str, self._xors))
+        return [[int(lit) for lit in row.split()] for row in text.split(" 0") if row.strip()]
+
+    def xors_num(self) -> int:
+        return self._xors.count(0)
+
+    def iter_clauses(self, start: int = 0, stop: int | None = None) -> Iterable[array]:
+        stop = self.clauses_num() if stop is None else stop
+        literals, offsets = self._literals, self._offsets
+        for k in range(start, stop):
+            yield literals[offsets[k]:offsets[k + 1] - 1]
+
+    def vars_num(self) -> int:
+        return self._v_pool.top
 
     def v_pool(self) -> IDPool:
         return self._v_pool
 
+    def named_ids(self) -> Iterator[tuple[str, int]]:
+        yield from self._v_pool.obj2id.items()
+        for name, (base, shape) in self._blocks.items():
+            for offset, index in enumerate(product(*[range(dim) for dim in shape])):
+                yield "_".join([name, *map(str, index)]), base + offset
+
+    def add_clause(self, clause: Iterable[int]) -> "CNF":
+        self._literals.extend(clause)
+        self._literals.append(0)
+        self._offsets.append(len(self._literals))
+        return self
+
+    def add_clauses(self, clauses: Iterable[Iterable[int]]) -> "CNF":
+        for clause in clauses:
+            self.add_clause(clause)
+        return self
+
+    def add_flat(self, literals: Iterable[int]) -> "CNF":
+        start = len(self._literals)
+        self._literals.extend(literals)
+        tail = self._literals[start:]
+        self._offsets.extend(start + i + 1 for i, lit in enumerate(tail) if lit == 0)
+        assert self._offsets[-1] == len(self._literals), "Clauses must be zero-terminated"
+        return self
+
+    def add_fixed(self, literals: Iterable[int], clause_len: int) -> "CNF":
+        start = len(self._literals)
+        self._literals.extend(literals)
+        stride = clause_len + 1
+        assert (len(self._literals) - start) % stride == 0, "Clauses must have equal lengths"
+        self._offsets.extend(range(start + stride, len(self._literals) + 1, stride))
+        return self
+
     def to_file(self, file_name: str) -> None:
-        buffer_size = 1024*1024
-        header = f"p cnf {self._cnf.nv} {len(self._cnf.clauses)}\n"
-        string = ' 0\n'.join([' '.join([str(lit) for lit in cl])
-                             for cl in self._cnf.clauses]) + ' 0\n'
-        with open(file_name, "w", buffering=buffer_size) as fp:
-            fp.write(header + string)
+        with open(file_name, "wb", buffering=DIMACS_BUFFER_SIZE) as fp:
+            self.write_dimacs(fp)
 
     def to_dimacs(self) -> str:
-        header_lines = [f"p cnf {self._cnf.nv} {len(self._cnf.clauses)}"]
-        clause_lines = [" ".join(map(str, clause)) + " 0" for clause in self._cnf.clauses]
-        lines = "\n".join(header_lines + clause_lines) + "\n"
-        return lines
+        buffer = BytesIO()
+        self.write_dimacs(buffer)
+        return buffer.getvalue().decode()
+
+    def write_dimacs(self, fp: BinaryIO, assumptions: list[int] = []) -> None:
+        vars_num = max([self.vars_num()] + [abs(lit) for lit in assumptions])
+        clauses_num = self.clauses_num() + self.xors_num() + len(self._atmosts) + len(assumptions)
+        header_format = "cnf+" if self._atmosts else "cnf"
+        fp.write(f"p {header_format} {vars_num} {clauses_num}\n".encode())
+        offsets = self._offsets
+        for k in range(0, self.clauses_num(), DIMACS_CHUNK):
+            stop = offsets[min(k + DIMACS_CHUNK, self.clauses_num())]
+            fp.write(dimacs_chunk(self._literals[offsets[k]:stop]))
+        if self._xors:
+            fp.write(dimacs_chunk(self._xors, "x"))
+        for lits, bound in self._atmosts:
+            fp.write(f"{' '.join(map(str, lits))} <= {bound}\n".encode())
+        if assumptions:
+            fp.write(dimacs_chunk(lit for a in assumptions for lit in (a, 0)))
 
     def check_name(self, name: str) -> bool:
         return name in self._v_pool.obj2id.keys()
@@ -103,6 +244,25 @@ class CNF():
         id = self._v_pool.id(name)
         return Literal(name, id)
 
+    def reserve_block(self, name: str, shape: tuple[int, ...]) -> int:
+        assert name[0].islower(), \
+            "Regular variable name cannot start with uppercase letter"
+        assert name not in self._blocks and name not in self._v_pool.obj2id, \
+            "Name already registered"
+        base = self._v_pool.top + 1
+        self._v_pool.top += prod(shape)
+        self._blocks[name] = (base, tuple(shape))
+        return base
+
+    def block_literal(self, name: str, index: tuple[int, ...]) -> Literal:
+        assert name in self._blocks, "Block not found"
+        base, shape = self._blocks[name]
+        assert len(index) == len(shape) and all(0 <= i < d for i, d in zip(index, shape))
+        offset = 0
+        for i, dim in zip(index, shape):
+            offset = offset * dim + i
+        return Literal("_".join([name, *map(str, index)]), base + offset)
+
     def reserve_names(self, names: Iterable[str], internal: bool = False) -> list[Literal]:
         return [self.reserve_name(name, internal) for name in names]
 
@@ -123,119 +283,142 @@ class CNF():
         if value is not None:
             sign = 1 if value else -1
             lval = sign * abs(lval)
-        self._cnf.append([lval])
-        return self
+        return self.add_clause((lval,))
 
     def set_literals(self, literals: list[Literal]) -> "CNF":
-        for lit in literals:
-            self.set_literal(lit)
-        return self
+        return self.add_flat(lit for literal in literals for lit in (literal.value(), 0))
 
     def equals(self, literal_a: Literal, literal_b: Literal) -> "CNF":
         lval_a = literal_a.value()
         lval_b = literal_b.value()
-        self._cnf.append([-lval_a, lval_b])
-        self._cnf.append([lval_a, -lval_b])
-        return self
+        return self.add_flat((-lval_a, lval_b, 0, lval_a, -lval_b, 0))
 
     def equals_and(self, literal_a: Literal, literals_b: list[Literal]) -> "CNF":
-        lval_a = literal_a.value()
-        self._cnf.append([lval_a] + [-(b_elem.value())
-                         for b_elem in literals_b])
-        new_clauses = [[-lval_a, b_elem.value()] for b_elem in literals_b]
-        self._cnf.clauses += new_clauses
-        return self
+        return self.equals_and_by_values(literal_a.value(), [b.value() for b in literals_b])
 
     def equals_and_by_values(self, literal_a: int, literals_b: list[int]) -> "CNF":
-        header_clauses = [[literal_a] + [-b_elem for b_elem in literals_b]]
-        new_clauses = header_clauses + [[-literal_a, b_elem] for b_elem in literals_b]
-        self._cnf.clauses += new_clauses
-        return self
+        flat = [literal_a, *[-b_elem for b_elem in literals_b], 0]
+        for b_elem in literals_b:
+            flat += (-literal_a, b_elem, 0)
+        return self.add_flat(flat)
 
     def equals_or(self, literal_a: Literal, literals_b: list[Literal]) -> "CNF":
-        lval_a = literal_a.value()
-        self._cnf.append([-lval_a] + [b_elem.value()
-                         for b_elem in literals_b])
-        new_clauses = [[lval_a, -b_elem.value()] for b_elem in literals_b]
-        self._cnf.clauses += new_clauses
-        return self
+        return self.equals_or_by_values(literal_a.value(), [b.value() for b in literals_b])
+
+    def equals_or_by_values(self, literal_a: int, literals_b: list[int]) -> "CNF":
+        flat = [-literal_a, *literals_b, 0]
+        for b_elem in literals_b:
+            flat += (literal_a, -b_elem, 0)
+        return self.add_flat(flat)
 
     def xor(self, literals: list[Literal]) -> "CNF":
+        return self.xor_by_values([lit.value() for lit in literals])
+
+    def xor_by_values(self, ids: list[int]) -> "CNF":
+        match self._xor_encoding:
+            case "native":
+                self._xors.extend([-ids[0], *ids[1:], 0])
+            case "chain":
+                self._xor_chain(ids)
+            case _:
+                self._xor_direct(ids)
+        return self
+
+    def xors_by_values(self, rows: Iterable[list[int]]) -> "CNF":
+        rows = [list(row) for row in rows]
+        lengths = {len(row) for row in rows}
+        limit = 3 if self._xor_encoding == "chain" else self._max_clause_len
+        if self._xor_encoding == "native" or len(lengths) != 1 or (limit and max(lengths) > limit):
+            for row in rows:
+                self.xor_by_values(row)
+            return self
+        signs = even_parity_signs(lengths.pop())
+        return self.add_fixed([
+            x for row in rows for sign in signs
+            for x in (*[one * a_id for one, a_id in zip(sign, row)], 0)
+        ], len(rows[0]))
+
+    def _xor_direct(self, ids: list[int]) -> None:
         clause_len = self._max_clause_len
         if clause_len and clause_len <= 2:
             raise ValueError("split must be greater than 2 if set to True")
-        if not clause_len or len(literals) <= clause_len:
-            ones = [[1, -1] for _ in literals]
-            ids = [a_elem.value() for a_elem in literals]
-            for prod in product(*ones):
-                if (sum(prod) - len(literals) + 2) % 4 == 0:
-                    self._cnf.append(
-                        [one * a_id for one, a_id in zip(prod, ids)])
+        if not clause_len or len(ids) <= clause_len:
+            self.add_fixed([
+                x for signs in even_parity_signs(len(ids))
+                for x in (*[one * a_id for one, a_id in zip(signs, ids)], 0)
+            ], len(ids))
         else:
-            _ = [a_elem.value() for a_elem in literals]
-            slice = literals[:clause_len - 1]
-            aux_literal = self.reserve_name(f"A{self._v_counter}", True)
-            self._v_counter += 1
-            self.xor([aux_literal] + slice)
-            self.xor([aux_literal] + literals[clause_len - 1:])
-        return self
+            aux_id = self._reserve_aux().value()
+            self._xor_direct([aux_id] + ids[:clause_len - 1])
+            self._xor_direct([aux_id] + ids[clause_len - 1:])
+
+    def _xor_chain(self, ids: list[int]) -> None:
+        if len(ids) <= 3:
+            self._xor_direct(ids)
+            return
+        prev = ids[0]
+        for a_id in ids[1:-2]:
+            aux_id = self._reserve_aux().value()
+            self._xor_direct([aux_id, prev, a_id])
+            prev = aux_id
+        self._xor_direct([prev, *ids[-2:]])
+
+    def _reserve_aux(self) -> Literal:
+        aux_literal = self.reserve_name(f"A{self._v_counter}", True)
+        self._v_counter += 1
+        return aux_literal
 
-    def atleast(self, literals: list[Literal], lower_bound: int) -> "CNF":
+    def atleast(
+        self, literals: list[Literal], lower_bound: int, encoding: str | None = None
+    ) -> "CNF":
         ids = [lit.value() for lit in literals]
-        clauses = CardEnc.atleast(
-            ids,
-            lower_bound,
-            encoding=self._caridnality_enc,
-            vpool=self._v_pool
-        )
-        self._cnf.extend(clauses)
-        return self
+        return self._add_cardinality(CardEnc.atleast, ids, lower_bound, encoding)
 
-    def atmost(self, literals: list[Literal], upper_bound: int) -> "CNF":
+    def atmost(
+        self, literals: list[Literal], upper_bound: int, encoding: str | None = None
+    ) -> "CNF":
         ids = [lit.value() for lit in literals]
-        clauses = CardEnc.atmost(
-            ids,
-            upper_bound,
-            encoding=self._caridnality_enc,
-            vpool=self._v_pool
-        )
-        self._cnf.extend(clauses)
-        return self
+        return self._add_cardinality(CardEnc.atmost, ids, upper_bound, encoding)
 
-    def exactly(self, literals: list[Literal], upper_bound: int) -> "CNF":
+    def exactly(
+        self, literals: list[Literal], upper_bound: int, encoding: str | None = None
+    ) -> "CNF":
         ids = [lit.value() for lit in literals]
-        clauses = CardEnc.equals(
+        return self._add_cardinality(CardEnc.equals, ids, upper_bound, encoding)
+
+    def _add_cardinality(self, encoder, ids: list[int], bound: int, encoding: str | None) -> "CNF":
+        encoding = self._cardinality_encoding if encoding is None else encoding
+        if encoding not in CARDINALITY_ENCODINGS:
+            raise ValueError(f"Cardinality encoding {encoding} not supported")
+        formula = encoder(
             ids,
-            upper_bound,
-            encoding=self._caridnality_enc,
+            bound,
+            encoding=CARDINALITY_ENCODINGS[encoding],
             vpool=self._v_pool
         )
-        self._cnf.extend(clauses)
+        self.add_clauses(formula.clauses)
+        self._atmosts += formula.atmosts
         return self
 
     def nand(self, literal_a: Literal, literal_b: Literal) -> "CNF":
         lval_a = literal_a.value()
         lval_b = literal_b.value()
-        self._cnf.append([-lval_a, -lval_b])
-        return self
+        return self.add_flat((-lval_a, -lval_b, 0))
 
     def exclude(self, literals: list[Literal]) -> "CNF":
-        aux_literal = self.reserve_name(f"A{self._v_counter}", True)
-        self._v_counter += 1
+        aux_literal = self._reserve_aux()
         self.equals_and(aux_literal, literals)
         self.set_literal(-aux_literal)
         return self
 
     def exclude_by_values(self, literals: list[int]) -> "CNF":
-        clause = [-lit for lit in literals]
-        self._cnf.clauses.append(clause)
-        return self
+        return self.add_clause(-lit for lit in literals)
 
     def make_dict_model(self, solution: Solution) -> dict:
         sat, solution_ints = solution
         if not sat:
             return {"sat": False}
-        all_literals = self.v_pool().obj2id.items()
-        model = {name: -id not in solution_ints for name, id in all_literals}
+        negative = {-lit for lit in solution_ints if lit < 0}
+        model = {name: id not in negative for name, id in self.named_ids()}
         model["sat"] = True
         return model
@@ -0,0 +1,135 @@
+import os
+import pickle
+import signal
+from contextlib import suppress
+from multiprocessing.connection import wait
+from signal import SIGKILL, SIGTERM
+from threading import current_thread, main_thread
+from sat.cnf import CNF, Solution
+from sat.solver import Solver
+
+
+# time limit, conflict limit
+Limits = tuple[float | None, int | None]
+
+
+def _race(solver: Solver, cnf: CNF, assumptions: list[int], limits: Limits, fd: int) -> None:
+    signal.signal(SIGTERM, signal.SIG_DFL)
+    os.setpgrp()  # external solvers join this group and die with it
+    try:
+        solution: Solution | None = solver.solve(cnf, assumptions, *limits)
+    except Exception:
+        solution = None
+    with os.fdopen(fd, "wb") as writer:
+        pickle.dump(solution, writer)
+
+
+def _terminate(signum, frame) -> None:
+    raise SystemExit(128 + signum)  # unwinds through solve() so the racers get killed
+
+
+def _start_racer(
+    solver: Solver, cnf: CNF, assumptions: list[int], limits: Limits
+) -> tuple[int, int]:
+    # a bare fork, multiprocessing refuses to start children from daemonic pool workers
+    reader, writer = os.pipe()
+    pid = os.fork()
+    if pid == 0:
+        os.close(reader)
+        try:
+            _race(solver, cnf, assumptions, limits, writer)
+        finally:
+            os._exit(0)
+    os.close(writer)
+    return reader, pid
+
+
+class PortfolioSolver:
+    def __init__(self, solvers: list[Solver | str]):
+        if not solvers:
+            raise ValueError("Portfolio needs at least one solver")
+        self._solvers = [s if isinstance(s, Solver) else Solver(s) for s in solvers]
+        self._winner: str | None = None
+        self._running: list[int] = []
+        self._cancelled = False
+
+    def name(self) -> str:
+        return "portfolio(" + ",".join(s.name() for s in self._solvers) + ")"
+
+    def solvers(self) -> list[Solver]:
+        return self._solvers
+
+    def winner(self) -> str | None:
+        return self._winner
+
+    def with_incremental(self) -> "PortfolioSolver":
+        raise ValueError(f"Solver {self.name()} does not support sessions")
+
+    def release(self) -> None:
+        pass
+
+    def cancel(self) -> None:
+        self._cancelled = True
+        for pid in list(self._running):
+            self._signal(pid)
+
+    def solve(
+        self,
+        cnf: CNF,
+        assumptions: list[int] = [],
+        time_limit: float | None = None,
+        conflict_limit: int | None = None,
+    ) -> Solution:
+        racers = {}
+        self._cancelled = False
+        # racers live in their own groups, a terminated parent must take them down itself
+        trapped = current_thread() is main_thread()
+        if trapped:
+            previous = signal.signal(SIGTERM, _terminate)
+        try:
+            for solver in self._solvers:
+                reader, pid = _start_racer(solver, cnf, assumptions, (time_limit, conflict_limit))
+                racers[reader] = (solver.name(), pid)
+                self._running.append(pid)
+            return self._await(racers)
+        finally:
+            self._running = []
+            for reader, (_, pid) in racers.items():
+                self._signal(pid)
+                os.waitpid(pid, 0)
+                os.close(reader)
+            if trapped:
+                signal.signal(SIGTERM, previous)
+
+    def _await(self, racers: dict[int, tuple[str, int]]) -> Solution:
+        unknown = False
+        pending = list(racers)
+        while pending and not self._cancelled:
+            for reader in wait(pending):
+                pending.remove(reader)
+                solution = self._receive(reader)
+                if solution is not None and solution[0] is not None:
+                    self._winner = racers[reader][0]
+                    return solution
+                unknown = unknown or solution is not None  # a racer ran out of its limits
+        if unknown or self._cancelled:
+            return None, []
+        raise ValueError(f"No solver in {self.name()} produced an answer")
+
+    @staticmethod
+    def _receive(reader: int) -> Solution | None:
+        chunks = []
+        while chunk := os.read(reader, 1 << 16):
+            chunks.append(chunk)
+        try:
+            return pickle.loads(b"".join(chunks))
+        except EOFError:
+            return None  # the racer died before answering
+
+    @staticmethod
+    def _signal(pid: int) -> None:
+        try:
+            os.killpg(pid, SIGKILL)
+        except ProcessLookupError:
+            with suppress(ProcessLookupError):
+                os.kill(pid, SIGKILL)  # killed before it became a group leader
@@ -1,10 +1,17 @@
+import os
 import pytest
 from random import randint, sample
 from itertools import product
 from functools import reduce
 from copy import deepcopy
-from sat.cnf import CNF
+from threading import Timer
+from time import perf_counter, sleep
+from io import BytesIO
+from multiprocessing import get_context
+from pysat.formula import CNF as CNF_core
+from sat.cnf import CNF, dimacs_chunk
 from sat.solver import Solver
+from sat.portfolio import PortfolioSolver
 
 
 solver_names = Solver.builtin_solvers
@@ -20,6 +27,21 @@ def triplet_cnf():
     return (cnf, literals)
 
 
+@pytest.fixture
+def pigeonhole_cnf():
+    holes = 10
+    cnf = CNF()
+    cnf.reserve_block("p", (holes + 1, holes))
+    pigeons = [[cnf.block_literal("p", (p, h)) for h in range(holes)] for p in range(holes + 1)]
+    for row in pigeons:
+        cnf.add_clause(lit.value() for lit in row)
+    for h in range(holes):
+        for p, q in product(range(holes + 1), repeat=2):
+            if p < q:
+                cnf.add_clause([-pigeons[p][h].value(), -pigeons[q][h].value()])
+    return cnf
+
+
 @pytest.fixture
 def long_cnf():
     cnf = CNF()
@@ -272,3 +294,285 @@ def test_atmost(long_cnf, solver):
     model = cnf.make_dict_model(solution)
     assert model["sat"]
     assert sum([model[lit.name()] for lit in literals]) <= upper_bound
+
+
+@pytest.mark.parametrize("solver", [s for s in solvers])
+def test_session_incremental(triplet_cnf, solver):
+    cnf, (a, b, c) = triplet_cnf
+    cnf.equals_and(a, [b, c])
+    with solver.open(cnf) as session:
+        loaded = session.clauses_loaded()
+        assert loaded == cnf.clauses_num()
+        assert session.solve([a.value()])
+        model = session.get_model()
+        assert b.value() in model and c.value() in model
+        assert not session.solve([a.value(), -b.value()])
+        cnf.set_literal(-c)
+        session.sync()
+        assert session.clauses_loaded() == loaded + 1
+        assert not session.solve([a.value()])
+        assert session.solve([-a.value()])
+        assert session.solves_num() == 4
+        assert session.solve_time() >= 0.0
+
+
+@pytest.mark.parametrize("solver_name", solver_names)
+def test_solver_incremental(triplet_cnf, solver_name):
+    solver = Solver(solver_name, incremental=True)
+    cnf, (a, b, c) = triplet_cnf
+    cnf.equals_or(a, [b, c])
+    model = cnf.make_dict_model(solver.solve(cnf, [a.value(), -b.value()]))
+    assert model["sat"]
+    assert model[c.name()]
+    session = solver.session()
+    loaded = session.clauses_loaded()
+    cnf.set_literal(-c)
+    model = cnf.make_dict_model(solver.solve(cnf, [a.value()]))
+    assert model["sat"]
+    assert model[b.name()]
+    assert solver.session() is session
+    assert session.clauses_loaded() == loaded + 1
+    solver.release()
+    assert solver.session() is None
+
+
+@pytest.mark.parametrize("_", epochs)
+def test_dimacs(long_cnf, tmp_path, _):
+    cnf, primary, literals = deepcopy(long_cnf)
+    cnf.equals_or(primary, literals)
+    cnf.atmost(literals, randint(1, len(literals) - 1))
+    file_name = str(tmp_path / "formula.cnf")
+    cnf.to_file(file_name)
+    loaded = CNF_core(from_file=file_name)
+    assert loaded.clauses == cnf.clauses()
+    assert CNF_core(from_string=cnf.to_dimacs()).clauses == cnf.clauses()
+    buffer = BytesIO()
+    cnf.write_dimacs(buffer, [primary.value()])
+    appended = CNF_core(from_string=buffer.getvalue().decode())
+    assert appended.clauses == cnf.clauses() + [[primary.value()]]
+
+
+def test_dimacs_empty_clause(triplet_cnf):
+    cnf, (a, b, _) = triplet_cnf
+    cnf.exclude_by_values([])
+    cnf.add_clause([a.value(), -b.value()])
+    cnf.add_flat([0])
+    lines = cnf.to_dimacs().splitlines()
+    assert lines[1:] == ["0", "1 -2 0", "0"]
+    assert dimacs_chunk([1, 0, 0, -2, 3, 0], "x") == b"x1 0\nx0\nx-2 3 0\n"
+
+
+def test_flat_store(triplet_cnf):
+    cnf, (a, b, c) = triplet_cnf
+    cnf.add_flat([a.value(), -b.value(), 0, c.value(), 0])
+    cnf.add_clause([-a.value(), b.value(), c.value()])
+    cnf.nand(a, c)
+    assert cnf.clauses_num() == 4
+    assert cnf.clauses() == [[1, -2], [3], [-1, 2, 3], [-1, -3]]
+    assert [clause.tolist() for clause in cnf.iter_clauses(1, 3)] == [[3], [-1, 2, 3]]
+    assert cnf.literals().tolist() == [1, -2, 0, 3, 0, -1, 2, 3, 0, -1, -3, 0]
+    assert cnf.vars_num() == 3
+    with pytest.raises(AssertionError):
+        cnf.add_flat([a.value()])
+
+
+def test_reserve_block(triplet_cnf):
+    cnf, (a, _, _) = triplet_cnf
+    base = cnf.reserve_block("x", (2, 3))
+    assert base == 4
+    assert cnf.vars_num() == 9
+    literal = cnf.block_literal("x", (1, 2))
+    assert (literal.name(), literal.value()) == ("x_1_2", 9)
+    assert cnf.reserve_name("y").value() == 10
+    cnf.add_fixed([a.value(), base, 0, -base, -literal.value(), 0], 2)
+    assert cnf.clauses() == [[1, 4], [-4, -9]]
+    named = dict(cnf.named_ids())
+    assert named["x_0_1"] == 5 and named["y"] == 10 and len(named) == 10
+    model = cnf.make_dict_model(Solver("minisat-gh").solve(cnf, [-a.value()]))
+    assert model["x_0_0"] and not model["x_1_2"]
+
+
+@pytest.mark.parametrize("xor_encoding", ["direct", "chain"])
+@pytest.mark.parametrize("_", epochs)
+def test_xor_encodings(xor_encoding, _):
+    cnf = CNF(xor_encoding)
+    literals = cnf.reserve_names(f"l{i}" for i in range(randint(1, max_variables)))
+    rows = [sample(literals, randint(1, len(literals))) for _ in range(randint(1, 4))]
+    cnf.xors_by_values([[lit.value() for lit in row] for row in rows])
+    assert cnf.xors_num() == 0
+    for values in product([False, True], repeat=min(len(literals), 4)):
+        assumptions = [lit.value() if v else -lit.value() for lit, v in zip(literals, values)]
+        sat, model = Solver("cadical153").solve(cnf, assumptions)
+        if sat:
+            model_set = set(model)
+            assert all(sum(lit.value() in model_set for lit in row) % 2 == 0 for row in rows)
+
+
+def test_xor_native():
+    cnf = CNF("native")
+    a, b, c = cnf.reserve_names(["a", "b", "c"])
+    cnf.xor([a, b, c])
+    cnf.xors_by_values([[a.value(), c.value()]])
+    cnf.set_literal(a)
+    assert cnf.xors_num() == 2
+    assert cnf.xors() == [[-1, 2, 3], [-1, 3]]
+    assert cnf.to_dimacs() == "p cnf 3 3\n1 0\nx-1 2 3 0\nx-1 3 0\n"
+    with pytest.raises(ValueError):
+        Solver("minisat-gh").solve(cnf)
+    with pytest.raises(ValueError):
+        CNF("gauss")
+
+
+@pytest.mark.parametrize("encoding", ["seqcounter", "totalizer", "cardnetwrk", "native"])
+@pytest.mark.parametrize("_", epochs)
+def test_cardinality_encodings(long_cnf, encoding, _):
+    cnf, _, literals = deepcopy(long_cnf)
+    lower_bound = randint(1, len(literals) - 1)
+    upper_bound = randint(lower_bound, len(literals) - 1)
+    cnf.atleast(literals, lower_bound, encoding)
+    cnf.atmost(literals, upper_bound, encoding)
+    assert bool(cnf.atmosts()) == (encoding == "native")
+    model = cnf.make_dict_model(Solver("gluecard4").solve(cnf))
+    assert model["sat"]
+    assert lower_bound <= sum(model[lit.name()] for lit in literals) <= upper_bound
+
+
+def test_cardinality_native(triplet_cnf):
+    cnf, literals = triplet_cnf
+    native = CNF(cardinality_encoding="native")
+    native.reserve_names(["a", "b", "c"])
+    native.exactly(literals, 2)
+    assert native.clauses_num() == 0 and len(native.atmosts()) == 2
+    assert native.to_dimacs().startswith("p cnf+ 3 2\n")
+    with pytest.raises(ValueError):
+        Solver("minisat-gh").solve(native)
+    with pytest.raises(ValueError):
+        cnf.exactly(literals, 2, "unary")
+    cnf.exactly(literals, 1, "pairwise")
+    assert cnf.cardinality_encoding() == "seqcounter"
+    model = cnf.make_dict_model(Solver("minisat-gh").solve(cnf))
+    assert sum(model[lit.name()] for lit in literals) == 1
+
+
+def test_portfolio(triplet_cnf):
+    cnf, (a, b, c) = triplet_cnf
+    cnf.equals_and(a, [b, c])
+    portfolio = PortfolioSolver(["minisat-gh", Solver("cadical153"), "glucose4"])
+    model = cnf.make_dict_model(portfolio.solve(cnf, [a.value()]))
+    assert model["sat"] and model[b.name()] and model[c.name()]
+    assert portfolio.winner() in ["minisat-gh", "cadical153", "glucose4"]
+    assert portfolio.solve(cnf, [a.value(), -b.value()]) == (False, [])
+
+    native = CNF(cardinality_encoding="native")
+    literals = native.reserve_names(["a", "b", "c"])
+    native.exactly(literals, 2)
+    portfolio = PortfolioSolver(["minisat-gh", "gluecard4"])
+    model = native.make_dict_model(portfolio.solve(native))
+    assert sum(model[lit.name()] for lit in literals) == 2
+    assert portfolio.winner() == "gluecard4"
+    with pytest.raises(ValueError):
+        PortfolioSolver(["minisat-gh", "cadical153"]).solve(native)
+
+
+def test_portfolio_limits(pigeonhole_cnf):
+    portfolio = PortfolioSolver(["minisat-gh", "cadical153"])
+    assert portfolio.solve(pigeonhole_cnf, conflict_limit=100) == (None, [])
+    start = perf_counter()
+    assert portfolio.solve(pigeonhole_cnf, time_limit=0.2) == (None, [])
+    assert perf_counter() - start < 5
+
+    timer = Timer(0.2, portfolio.cancel)
+    timer.start()
+    start = perf_counter()
+    assert portfolio.solve(pigeonhole_cnf) == (None, [])
+    assert perf_counter() - start < 5
+    timer.join()
+
+
+_pooled_cnf: CNF | None = None
+
+
+def _pooled_portfolio(_) -> None:
+    assert _pooled_cnf is not None
+    PortfolioSolver(["minisat-gh", "glucose4"]).solve(_pooled_cnf)
+
+
+def _children(pid: int) -> list[int]:
+    children = []
+    for entry in filter(str.isdigit, os.listdir("/proc")):
+        try:
+            with open(f"/proc/{entry}/stat") as stat:
+                fields = stat.read().rsplit(")", 1)[1].split()
+        except (FileNotFoundError, ProcessLookupError):
+            continue
+        if fields[0] != "Z" and int(fields[1]) == pid:
+            children.append(int(entry))
+    return children
+
+
+def _alive(pid: int) -> bool:
+    try:
+        with open(f"/proc/{pid}/stat") as stat:
+            return stat.read().rsplit(")", 1)[1].split()[0] != "Z"
+    except FileNotFoundError:
+        return False
+
+
+def test_portfolio_terminated_pool(pigeonhole_cnf):
+    global _pooled_cnf
+    _pooled_cnf = pigeonhole_cnf
+    pool = get_context("fork").Pool(1)
+    pool.map_async(_pooled_portfolio, [None])
+    worker = pool._pool[0].pid  # type: ignore[attr-defined]
+    deadline = perf_counter() + 5
+    while len(_children(worker)) < 2 and perf_counter() < deadline:
+        sleep(0.05)
+    racers = _children(worker)
+    assert len(racers) == 2
+    pool.terminate()
+    pool.join()
+    deadline = perf_counter() + 5
+    while any(map(_alive, racers)) and perf_counter() < deadline:
+        sleep(0.05)
+    assert not any(map(_alive, racers))
+
+
+def test_solve_limits(pigeonhole_cnf):
+    assert Solver("minisat-gh").solve(pigeonhole_cnf, conflict_limit=100) == (None, [])
+    assert Solver("cadical153").solve(pigeonhole_cnf, conflict_limit=100) == (None, [])
+
+    start = perf_counter()
+    assert Solver("glucose4", time_limit=0.2).solve(pigeonhole_cnf) == (None, [])
+    assert perf_counter() - start < 5
+
+    with pytest.raises(ValueError):
+        Solver("cadical153").solve(pigeonhole_cnf, time_limit=0.2)
+    with pytest.raises(ValueError):
+        Solver("lingeling").solve(pigeonhole_cnf, conflict_limit=100)
+
+
+def test_solve_limits_incremental(triplet_cnf, pigeonhole_cnf):
+    solver = Solver("minisat-gh", incremental=True, conflict_limit=100)
+    assert solver.solve(pigeonhole_cnf) == (None, [])
+    cnf, (a, b, c) = triplet_cnf
+    cnf.equals_and(a, [b, c])
+    assert solver.solve(cnf, [a.value(), -b.value()]) == (False, [])
+    assert cnf.make_dict_model(solver.solve(cnf, [a.value()]))["sat"]
+    solver.release()
+
+
+def test_cancel(pigeonhole_cnf):
+    solver = Solver("maplesat")
+    timer = Timer(0.2, solver.cancel)
+    timer.start()
+    start = perf_counter()
+    assert solver.solve(pigeonhole_cnf) == (None, [])
+    assert perf_counter() - start < 5
+    timer.join()
+
+
+def test_parse_solution():
+    assert Solver._parse_solution("s SATISFIABLE\nv 1 -2\nv 3 0\n") == (True, [1, -2, 3])
+    assert Solver._parse_solution("c 12 conflicts\ns UNSATISFIABLE\n") == (False, [])
+    assert Solver._parse_solution("s UNKNOWN\n") == (None, [])
+    assert Solver._parse_solution("") == (None, [])
@@ -1,19 +1,168 @@
 from pysat.solvers import Solver as PySolver
-from subprocess import Popen, PIPE
+from subprocess import Popen, PIPE, DEVNULL, TimeoutExpired
+from threading import Timer
 from sat.cnf import CNF, Solution
+from time import perf_counter
 
-import threading
-import queue
+# pysat cannot interrupt these solvers; lingeling also ignores conflict budgets
+UNINTERRUPTIBLE_SOLVERS = ("cadical103", "cadical153", "lingeling")
+
+
+class SolverSession:
+    def __init__(self, name: str, cnf: CNF | None = None):
+        self._name = name
+        self._solver = PySolver(name=name)
+        self._cnf: CNF | None = None
+        self._synced_num = 0
+        self._synced_atmosts = 0
+        self._clauses_loaded = 0
+        self._solves_num = 0
+        self._solve_time = 0.0
+        if cnf is not None:
+            self.bind(cnf)
+
+    def __enter__(self) -> "SolverSession":
+        return self
+
+    def __exit__(self, *_) -> None:
+        self.close()
+
+    def __str__(self) -> str:
+        return (
+            f"clauses loaded: {self._clauses_loaded}, "
+            f"solves: {self._solves_num}, "
+            f"solve time: {self._solve_time:.3f}s"
+        )
+
+    def clauses_loaded(self) -> int:
+        return self._clauses_loaded
+
+    def solves_num(self) -> int:
+        return self._solves_num
+
+    def solve_time(self) -> float:
+        return self._solve_time
+
+    def bind(self, cnf: CNF) -> "SolverSession":
+        assert self._cnf is None, "Session already bound to a CNF"
+        self._cnf = cnf
+        self._synced_num = 0
+        self._synced_atmosts = 0
+        return self.sync()
+
+    def bound_to(self, cnf: CNF) -> bool:
+        return self._cnf is cnf
+
+    def sync(self) -> "SolverSession":
+        assert self._cnf is not None, "Session not bound to a CNF"
+        if self._cnf.xors_num():
+            raise ValueError("Native XOR constraints require an XOR-aware solver")
+        clauses_num = self._cnf.clauses_num()
+        self._solver.append_formula(self._cnf.iter_clauses(self._synced_num, clauses_num))
+        self._clauses_loaded += clauses_num - self._synced_num
+        self._synced_num = clauses_num
+        atmosts = self._cnf.atmosts()
+        if len(atmosts) > self._synced_atmosts and not self._solver.supports_atmost():
+            raise ValueError("Native cardinality constraints require minicard or gluecard")
+        for lits, bound in atmosts[self._synced_atmosts:]:
+            self._solver.add_atmost(lits, bound)
+        self._synced_atmosts = len(atmosts)
+        return self
+
+    def add_clauses(self, clauses: list[list[int]]) -> "SolverSession":
+        self._solver.append_formula(clauses)
+        self._clauses_loaded += len(clauses)
+        return self
+
+    def solve(
+        self,
+        assumptions: list[int] = [],
+        time_limit: float | None = None,
+        conflict_limit: int | None = None,
+    ) -> bool | None:
+        start = perf_counter()
+        try:
+            if self.interruptible():
+                sat = self._solve_limited(assumptions, time_limit, conflict_limit)
+            elif time_limit is not None:
+                raise ValueError(f"Solver {self._name} does not support time limits")
+            elif conflict_limit is not None:
+                self._solver.conf_budget(conflict_limit)
+                sat = self._solver.solve_limited(assumptions=assumptions)
+            else:
+                sat = bool(self._solver.solve(assumptions=assumptions))
+        except NotImplementedError:
+            raise ValueError(f"Solver {self._name} does not support conflict limits")
+        finally:
+            self._solve_time += perf_counter() - start
+            self._solves_num += 1
+        return sat
+
+    def _solve_limited(
+        self, assumptions: list[int], time_limit: float | None, conflict_limit: int | None
+    ) -> bool | None:
+        self._solver.conf_budget(-1 if conflict_limit is None else conflict_limit)
+        timer = None
+        if time_limit is not None:
+            timer = Timer(time_limit, self.interrupt)
+            timer.start()
+        try:
+            return self._solver.solve_limited(assumptions=assumptions, expect_interrupt=True)
+        finally:
+            if timer is not None:
+                timer.cancel()
+            self._solver.clear_interrupt()
+
+    def interruptible(self) -> bool:
+        return self._name not in UNINTERRUPTIBLE_SOLVERS
+
+    def interrupt(self) -> None:
+        if self.interruptible():
+            self._solver.interrupt()
+
+    def get_model(self) -> list[int]:
+        model = self._solver.get_model()
+        return [] if model is None else model
+
+    def get_core(self) -> list[int]:
+        core = self._solver.get_core()
+        return [] if core is None else core
+
+    def solution(
+        self,
+        assumptions: list[int] = [],
+        time_limit: float | None = None,
+        conflict_limit: int | None = None,
+    ) -> Solution:
+        sat = self.solve(assumptions, time_limit, conflict_limit)
+        if sat is None:
+            return (None, [])
+        if sat:
+            ids = self.get_model()
+            if ids:
+                return (True, ids)
+        return (False, [])
+
+    def close(self) -> None:
+        self._solver.delete()
+        self._cnf = None
 
 
 class Solver:
     external_solvers = {
         "kissat": ["-q"],
+        "cryptominisat5": ["--verb", "0"],
         # "kissat": [],
-        # "cms":["--verb", "0"],
         # "parkissat": ["-v=1", "-c=8", "-max-memory=8"]
     }
 
+    xor_solvers = ["cryptominisat5"]
+
+    conflict_limit_args = {
+        "kissat": "--conflicts={}",
+        "cryptominisat5": "--maxconfl={}",
+    }
+
     builtin_solvers = [
         "cadical103",
         "cadical153",
@@ -34,83 +183,153 @@ class Solver:
 
     available_solvers = list(external_solvers.keys()) + builtin_solvers
 
-    def __init__(self, name: str, args=None):
+    def __init__(
+        self,
+        name: str,
+        args=None,
+        incremental: bool = False,
+        time_limit: float | None = None,
+        conflict_limit: int | None = None,
+    ):
         if name not in Solver.available_solvers:
             raise ValueError(f"Solver {name} not supported")
+        assert time_limit is None or time_limit > 0
+        assert conflict_limit is None or conflict_limit > 0
         self.__name = name
         self.__args = args
+        self.__incremental = incremental
+        self.__time_limit = time_limit
+        self.__conflict_limit = conflict_limit
+        self.__session: SolverSession | None = None
+        self.__running: SolverSession | Popen | None = None
+
+    def __getstate__(self) -> dict:
+        state = self.__dict__.copy()
+        state["_Solver__session"] = None
+        state["_Solver__running"] = None
+        return state
+
+    def name(self) -> str:
+        return self.__name
+
+    def incremental(self) -> bool:
+        return self.__incremental
+
+    def with_incremental(self) -> "Solver":
+        if self.__name not in self.builtin_solvers:
+            raise ValueError(f"Solver {self.__name} does not support sessions")
+        if self.__incremental:
+            return self
+        return Solver(
+            self.__name, self.__args, True, self.__time_limit, self.__conflict_limit
+        )
+
+    def open(self, cnf: CNF | None = None) -> "SolverSession":
+        if self.__name not in self.builtin_solvers:
+            raise ValueError(f"Solver {self.__name} does not support sessions")
+        return SolverSession(self.__name, cnf)
 
-    def solve(self, cnf: CNF) -> Solution:
+    def session(self) -> "SolverSession | None":
+        return self.__session
+
+    def release(self) -> None:
+        if self.__session is not None:
+            self.__session.close()
+        self.__session = None
+
+    def cancel(self) -> None:
+        running = self.__running
+        if isinstance(running, SolverSession):
+            running.interrupt()
+        elif running is not None:
+            running.kill()
+
+    def solve(
+        self,
+        cnf: CNF,
+        assumptions: list[int] = [],
+        time_limit: float | None = None,
+        conflict_limit: int | None = None,
+    ) -> Solution:
+        time_limit = self.__time_limit if time_limit is None else time_limit
+        conflict_limit = self.__conflict_limit if conflict_limit is None else conflict_limit
         if self.__name in self.builtin_solvers:
-            solution = self._solve_builtin(cnf)
+            solution = self._solve_builtin(cnf, assumptions, time_limit, conflict_limit)
         elif self.__name in self.external_solvers:
-            solution = self._solve_external(cnf)
+            solution = self._solve_external(cnf, assumptions, time_limit, conflict_limit)
         else:
             raise ValueError(f"Solver {self.__name} not supported")
         return solution
 
-    def _solve_builtin(self, cnf: CNF) -> Solution:
-        clauses = cnf.clauses()
-        with PySolver(name=self.__name, bootstrap_with=clauses) as builtin_solver:
-            if builtin_solver.solve():
-                ids = builtin_solver.get_model()
-                if ids:
-                    return (True, ids)
-                else:
-                    return (False, [])
-            else:
-                return (False, [])
-
-    def _solve_external(self, cnf: CNF) -> Solution:
-        args = self.external_solvers[self.__name]
-        if self.__args is not None:
-            args += self.__args
-        p = Popen([self.__name, *args], stdin=PIPE, stdout=PIPE, stderr=PIPE)
-
-        clauses = cnf._cnf.clauses
-        cls_num = len(clauses)
-        step = 20000
-
-        def producer(out_q):
-            header = f"p cnf {cnf._cnf.nv} {cls_num}\n"
-            out_q.put(header)
-            for i in range(0, cls_num, step):
-                slice = clauses[i : i + step]
-                string = " 0\n".join([" ".join([str(lit) for lit in cl]) for cl in slice]) + " 0\n"
-                out_q.put(string)
-            out_q.put(None)
-
-        def consumer(in_q, p):
-            while True:
-                item = in_q.get()
-                if item is None:
-                    break
-                p.stdin.write(item.encode())
-            p.stdin.close()
-
-        q = queue.Queue()
-        t1 = threading.Thread(target=producer, args=(q,))
-        t2 = threading.Thread(target=consumer, args=(q, p))
-        t1.start()
-        t2.start()
-        t1.join()
-        t2.join()
-
-        assert p.stdout is not None
-        out = p.stdout.read()
+    def _solve_builtin(self, cnf: CNF, assumptions: list[int], *limits) -> Solution:
+        if self.__incremental:
+            return self._solve_live(cnf, assumptions, *limits)
+        with self.open(cnf) as session:
+            return self._run(session, assumptions, *limits)
+
+    def _solve_live(self, cnf: CNF, assumptions: list[int], *limits) -> Solution:
+        if self.__session is None or not self.__session.bound_to(cnf):
+            self.release()
+            self.__session = self.open(cnf)
+        else:
+            self.__session.sync()
+        return self._run(self.__session, assumptions, *limits)
+
+    def _run(self, session: SolverSession, assumptions: list[int], *limits) -> Solution:
+        self.__running = session
+        try:
+            return session.solution(assumptions, *limits)
+        finally:
+            self.__running = None
+
+    def _solve_external(
+        self,
+        cnf: CNF,
+        assumptions: list[int],
+        time_limit: float | None,
+        conflict_limit: int | None,
+    ) -> Solution:
+        if cnf.xors_num() and self.__name not in self.xor_solvers:
+            raise ValueError(f"Solver {self.__name} does not support native XOR constraints")
+        if cnf.atmosts():
+            raise ValueError(f"Solver {self.__name} does not support native cardinality")
+        args = [*self.external_solvers[self.__name], *(self.__args or [])]
+        if conflict_limit is not None:
+            args.append(self.conflict_limit_args[self.__name].format(conflict_limit))
+        p = Popen([self.__name, *args], stdin=PIPE, stdout=PIPE, stderr=DEVNULL)
+        self.__running = p
+
+        assert p.stdin is not None and p.stdout is not None
+        try:
+            try:
+                cnf.write_dimacs(p.stdin, assumptions)
+            except BrokenPipeError:
+                pass  # cancelled while the formula was being written
+            out, _ = p.communicate(timeout=time_limit)
+        except TimeoutExpired:
+            p.kill()
+            p.wait()
+            p.stdout.close()
+            return (None, [])
+        finally:
+            self.__running = None
 
         string = out.decode("utf-8")
         return self._parse_solution(string)
 
     @staticmethod
     def _parse_solution(string: str) -> Solution:
-        string = string.lower()
-        if "unsat" in string:
+        lines = string.lower().splitlines()
+        status = [line.split()[1:] for line in lines if line.startswith("s ")]
+        if ["unsatisfiable"] in status:
             return (False, [])
+        if ["satisfiable"] not in status:
+            return (None, [])  # unknown, interrupted or killed
 
         def is_int(s):
             return s.isdigit() or (s[0] == "-" and s[1:].isdigit())
 
-        ints = [int(s) for s in string.split() if is_int(s)]
+        values = [line.split() for line in lines if line.startswith("v ")]
+        ints = [int(s) for line in values for s in line if is_int(s)]
         ids = [i for i in ints if i != 0]
         return (True, ids)
@@ -2,17 +2,44 @@ from circuit.circuit import Circuit, Gate
 from circuit.dim_group import DimGroup
 from circuit.collection import Collection
 from truth_table.truth_table import TruthTable
-from sat.cnf import CNF, Literal
+from sat.cnf import CNF, Literal, Solution
 from sat.solver import Solver
-from itertools import product
+from synthesizers.template_cache import Template, TemplateCache, template_cache
 from functools import reduce
+from multiprocessing import get_context
 
 
 LiteralGrid = list[list[Literal]]
 
+_cube_synthesizer: "CircuitSynthesizer | None" = None
+_cube_solver: Solver | None = None
+
+
+def _init_cube_worker(synthesizer: "CircuitSynthesizer") -> None:
+    # one live session per worker, cubes are only assumptions on it
+    global _cube_synthesizer, _cube_solver
+    _cube_synthesizer = synthesizer
+    _cube_solver = synthesizer._solver
+    if _cube_solver.name() in Solver.builtin_solvers:
+        _cube_solver = _cube_solver.with_incremental()
+
+
+def _solve_cube(cube: list[int]) -> Solution:
+    assert _cube_synthesizer is not None and _cube_solver is not None
+    return _cube_solver.solve(_cube_synthesizer._cnf, cube)
+
 
 class CircuitSynthesizer:
-    def __init__(self, output: TruthTable, gate_count: int, solver: Solver):
+    def __init__(
+        self,
+        output: TruthTable,
+        gate_count: int,
+        solver: Solver,
+        optional_gates: bool = False,
+        cache: TemplateCache | None = template_cache,
+        xor_encoding: str = "direct",
+        cardinality_encoding: str = "seqcounter",
+    ):
         assert len(output) >= 2
         assert len(output) == pow(2, len(output[0]))
         assert all(len(word) == len(output[0]) for word in output)
@@ -24,62 +51,140 @@ class CircuitSynthesizer:
         self._width = len(output[0])
         self._words = len(output)
         self._circuit = None
+        self._optional_gates = optional_gates
+        self._enables: list[Literal] = []
+        self._cache = cache
+        self._xor_encoding = xor_encoding
+        self._cardinality_encoding = cardinality_encoding
         self._cnf, self._controls, self._targets = self._make_revcirc_cnf()
 
     def _make_revcirc_cnf(self) -> tuple[CNF, LiteralGrid, LiteralGrid]:
-        cnf = CNF()
-        line_iter = range(self._width)
-        gate_iter = range(self._gate_count)
-        ext_gate_iter = range(self._gate_count + 1)
-        word_iter = range(self._words)
-
-        controls = [[cnf.reserve_name(f"c_{lid}_{gid}") for lid in line_iter] for gid in gate_iter]
-        targets = [[cnf.reserve_name(f"t_{lid}_{gid}") for lid in line_iter] for gid in gate_iter]
-        or_bits = [[[cnf.reserve_name(f"o_{lid}_{gid}_{wid}") for lid in line_iter]
-                    for gid in gate_iter] for wid in word_iter]
-        data_bits = [[[cnf.reserve_name(f"d_{lid}_{gid}_{wid}") for lid in line_iter]
-                      for gid in ext_gate_iter] for wid in word_iter]
-        add_bits = [[cnf.reserve_name(f"a_{gid}_{wid}") for gid in gate_iter] for wid in word_iter]
-        switch_bits = [[[cnf.reserve_name(f"s_{lid}_{gid}_{w}") for lid in line_iter]
-                        for gid in gate_iter] for w in word_iter]
+        key = (
+            self._width,
+            self._gate_count,
+            self._optional_gates,
+            self._xor_encoding,
+            self._cardinality_encoding,
+        )
+        template = None if self._cache is None else self._cache.get(key)
+        if template is None:
+            template = self._make_template()
+            if self._cache is not None:
+                self._cache.put(key, template)
+        cnf, bases = template
+
+        controls = self._block_grid(cnf, "c")
+        targets = self._block_grid(cnf, "t")
+        self._enables = [cnf.block_literal("e", (gid,)) for gid in range(self._gate_count)
+                         if self._optional_gates]
+        self._encode_outputs(cnf, bases["d"])
+        return cnf, controls, targets
+
+    def _make_template(self) -> Template:
+        cnf = CNF(self._xor_encoding, self._cardinality_encoding)
+        shape = (self._gate_count, self._width)
+        word_shape = (self._words, *shape)
+        ext_word_shape = (self._words, self._gate_count + 1, self._width)
+        bases = {
+            "c": cnf.reserve_block("c", shape),
+            "t": cnf.reserve_block("t", shape),
+            "o": cnf.reserve_block("o", word_shape),
+            "d": cnf.reserve_block("d", ext_word_shape),
+            "a": cnf.reserve_block("a", (self._words, self._gate_count)),
+            "s": cnf.reserve_block("s", word_shape),
+        }
+        if self._optional_gates:
+            bases["e"] = cnf.reserve_block("e", (self._gate_count,))
+
+        self._encode_gates(cnf, bases, self._block_grid(cnf, "t"))
+        self._encode_words(cnf, bases)
+        self._encode_inputs(cnf, bases["d"])
+        return cnf, bases
+
+    def _block_grid(self, cnf: CNF, name: str) -> LiteralGrid:
+        return [[cnf.block_literal(name, (gid, lid)) for lid in range(self._width)]
+                for gid in range(self._gate_count)]
+
+    def _encode_gates(self, cnf: CNF, bases: dict[str, int], targets: LiteralGrid) -> None:
+        c0, t0 = bases["c"], bases["t"]
+        cells = range(self._gate_count * self._width)
 
         # Single target per gate
         for target_layer in targets:
             cnf.exactly(target_layer, 1)
 
         # Target qubit cannot be a control qubit
-        for gid, lid in product(gate_iter, line_iter):
-            cnf.nand(targets[gid][lid], controls[gid][lid])
+        cnf.add_fixed([x for k in cells for x in (-(t0 + k), -(c0 + k), 0)], 2)
+
+        if self._optional_gates:
+            e0 = bases["e"]
+            # Disabled gate has no controls
+            cnf.add_fixed([x for k in cells for x in (e0 + k // self._width, -(c0 + k), 0)], 2)
+            # Disabled gates precede enabled ones
+            gates = range(e0, e0 + self._gate_count - 1)
+            cnf.add_fixed([x for e in gates for x in (-e, e + 1, 0)], 2)
 
-        # Target qubit is the data bit
-        for wid, gid, lid in product(word_iter, gate_iter, line_iter):
-            cnf.equals_or(or_bits[wid][gid][lid], [data_bits[wid][gid][lid], -controls[gid][lid]])
+    def _encode_words(self, cnf: CNF, bases: dict[str, int]) -> None:
+        width, layer = self._width, self._gate_count * self._width
+        cells = range(self._words * layer)
+        ors = range(bases["o"], bases["o"] + len(cells))
+        switches = range(bases["s"], bases["s"] + len(cells))
+        data = [bases["d"] + k + k // layer * width for k in cells]
+        nexts = [d + width for d in data]
+        ctrls = [bases["c"] + k % layer for k in cells]
+        trgs = [bases["t"] + k % layer for k in cells]
+        adds = [bases["a"] + k // width for k in cells]
 
-        # Add bit is the or of all or bits
-        for wid, gid in product(word_iter, gate_iter):
-            l_list = [or_bits[wid][gid][lid] for lid in line_iter]
-            cnf.equals_and(add_bits[wid][gid], l_list)
+        # Or bit is the data bit or the negated control
+        cnf.add_fixed([x for o, d, c in zip(ors, data, ctrls) for x in (-o, d, -c, 0)], 3)
+        cnf.add_fixed([x for o, d, c in zip(ors, data, ctrls) for x in (o, -d, 0, o, c, 0)], 2)
+
+        # Add bit is the and of all or bits (and the gate enable)
+        enables = [bases["e"] + gid for gid in range(self._gate_count)] \
+            if self._optional_gates else []
+        o_rows = range(bases["o"], bases["o"] + len(cells), width)
+        and_args = [[*range(o, o + width), *enables[aid % self._gate_count:][:1]]
+                    for aid, o in enumerate(o_rows)]
+        add_ids = range(bases["a"], bases["a"] + len(and_args))
+        and_len = 1 + width + int(self._optional_gates)
+        cnf.add_fixed([x for a, args in zip(add_ids, and_args)
+                       for x in (a, *[-b for b in args], 0)], and_len)
+        cnf.add_fixed([x for a, args in zip(add_ids, and_args)
+                       for b in args for x in (-a, b, 0)], 2)
 
         # Switch bit is the add bit and the target qubit
-        for wid, gid, lid in product(word_iter, gate_iter, line_iter):
-            cnf.equals_and(switch_bits[wid][gid][lid], [add_bits[wid][gid], targets[gid][lid]])
+        cnf.add_fixed([x for s, a, t in zip(switches, adds, trgs) for x in (s, -a, -t, 0)], 3)
+        cnf.add_fixed([x for s, a, t in zip(switches, adds, trgs) for x in (-s, a, 0, -s, t, 0)], 2)
 
         # Data bit is the previous data bit xored with the switch bit
-        for wid, gid, lid in product(word_iter, gate_iter, line_iter):
-            cnf.xor([data_bits[wid][gid+1][lid], data_bits[wid]
-                    [gid][lid], switch_bits[wid][gid][lid]])
+        cnf.xors_by_values(zip(nexts, data, switches))
 
-        # Input/Output edge constraints
-        for wid, lid in product(word_iter, line_iter):
-            cnf.set_literal(data_bits[wid][0][lid], (wid >> lid & 1 == 1))
+    def _encode_inputs(self, cnf: CNF, d0: int) -> None:
+        word_vars = (self._gate_count + 1) * self._width
 
-        for wid, lid in product(word_iter, line_iter):
-            if self._output[wid][lid] in [0, 1]:
-                a = data_bits[wid][self._gate_count][lid]
-                b = (self._output[wid][lid] == 1)
-                cnf.set_literal(a, b)
+        # Input edge constraints
+        inputs = [(d0 + wid * word_vars + lid, wid >> lid & 1)
+                  for wid in range(self._words) for lid in range(self._width)]
+        cnf.add_fixed([x for d, bit in inputs for x in (d if bit else -d, 0)], 1)
 
-        return cnf, controls, targets
+    def _encode_outputs(self, cnf: CNF, d0: int) -> None:
+        word_vars = (self._gate_count + 1) * self._width
+        layer = self._gate_count * self._width
+
+        # Output edge constraints
+        outputs = [(d0 + wid * word_vars + layer + lid, bit)
+                   for wid in range(self._words) for lid, bit in enumerate(self._output[wid])]
+        cnf.add_fixed([x for d, bit in outputs if bit in [0, 1]
+                       for x in (d if bit else -d, 0)], 1)
+
+    def gate_count_assumptions(self, gate_count: int) -> list[int]:
+        assert self._optional_gates, "Gate count can be assumed only with optional gates"
+        assert 0 <= gate_count and gate_count <= self._gate_count
+        disabled = self._gate_count - gate_count
+        return [
+            lit.value() if gid >= disabled else -lit.value()
+            for gid, lit in enumerate(self._enables)
+        ]
 
     def _gate_exclusion_list(self, layer: int, gate: Gate) -> list[int]:
         controls, target = gate
@@ -93,6 +198,8 @@ class CircuitSynthesizer:
             t_literal = self._targets[layer][i].value()
             t_literal = t_literal if i == target else -t_literal
             exclusion_list += [c_literal, t_literal]
+        if self._optional_gates:
+            exclusion_list.append(self._enables[layer].value())
         return exclusion_list
 
     def exclude_solution(self, circuit: Circuit) -> "CircuitSynthesizer":
@@ -103,6 +210,7 @@ class CircuitSynthesizer:
                 exclusion_list += self._gate_exclusion_list(layer, gate)
             circuit._exclusion_list = exclusion_list
         self._cnf.exclude_by_values(circuit._exclusion_list)
+        self._circuit = None
         return self
 
     def disable_empty_lines(self) -> "CircuitSynthesizer":
@@ -123,11 +231,74 @@ class CircuitSynthesizer:
             self._cnf.atleast(line_controls, 1)
         return self
 
-    def set_global_controls_num(self, controls_num: int) -> "CircuitSynthesizer":
+    def disable_identical_adjacent_gates(self) -> "CircuitSynthesizer":
+        width = self._width
+        pairs = range(self._gate_count - 1)
+        base = self._cnf.reserve_block("ident", (len(pairs), 2, width))
+        for gid in pairs:
+            diffs = []
+            for kind, grid in enumerate((self._controls, self._targets)):
+                for lid in range(width):
+                    diff = base + (gid * 2 + kind) * width + lid
+                    lhs, rhs = grid[gid][lid].value(), grid[gid + 1][lid].value()
+                    self._cnf.add_fixed((-diff, lhs, rhs, 0, -diff, -lhs, -rhs, 0), 3)
+                    diffs.append(diff)
+            if self._optional_gates:
+                diffs.append(-self._enables[gid].value())
+            self._cnf.add_clause(diffs)
+        return self
+
+    def order_commuting_gates(self) -> "CircuitSynthesizer":
+        self._order_commuting_targets()
+        self._order_commuting_controls()
+        return self
+
+    def _order_commuting_targets(self) -> None:
+        controls, targets = self._controls, self._targets
+        line_pairs = [(lid, mid) for lid in range(self._width) for mid in range(lid)]
+        for gid in range(self._gate_count - 1):
+            self._cnf.add_fixed([
+                x for lid, mid in line_pairs
+                for x in (
+                    -targets[gid][lid].value(), -targets[gid + 1][mid].value(),
+                    controls[gid + 1][lid].value(), controls[gid][mid].value(), 0,
+                )
+            ], 4)
+
+    def _order_commuting_controls(self) -> None:
+        width = self._width
+        pairs = range(self._gate_count - 1)
+        base = self._cnf.reserve_block("lex", (len(pairs), width))
+        for gid in pairs:
+            equal = range(base + gid * width, base + (gid + 1) * width)
+            lhs = [lit.value() for lit in self._controls[gid]]
+            rhs = [lit.value() for lit in self._controls[gid + 1]]
+            lhs_t = [lit.value() for lit in self._targets[gid]]
+            rhs_t = [lit.value() for lit in self._targets[gid + 1]]
+            self._cnf.add_fixed([x for t, u in zip(lhs_t, rhs_t) for x in (-t, -u, equal[0], 0)], 3)
+            self._cnf.add_fixed([x for e, c, d in zip(equal, lhs, rhs) for x in (-e, -c, d, 0)], 3)
+            self._cnf.add_fixed([
+                x for e, c, d, e_next in zip(equal, lhs, rhs, equal[1:])
+                for x in (-e, c, d, e_next, 0, -e, -c, -d, e_next, 0)
+            ], 4)
+
+    def set_global_controls_num(
+        self, controls_num: int, encoding: str | None = None
+    ) -> "CircuitSynthesizer":
         assert 0 <= controls_num and controls_num <= (self._width - 1) * self._gate_count
         self._global_controls_num = controls_num
         all_controls = reduce(lambda x, y: x+y, self._controls)
-        self._cnf.exactly(all_controls, controls_num)
+        self._cnf.exactly(all_controls, controls_num, encoding)
+        return self
+
+    def set_max_gate_controls_num(
+        self, controls_num: int, encoding: str | None = None
+    ) -> "CircuitSynthesizer":
+        # gate 0 carries the maximum, any circuit can be rotated into this form
+        assert 0 <= controls_num and controls_num < self._width
+        self._cnf.exactly(self._controls[0], controls_num, encoding)
+        for gate_controls in self._controls[1:]:
+            self._cnf.atmost(gate_controls, controls_num, encoding)
         return self
 
     def exclude_subcircircuit(self, circuit: Circuit) -> "CircuitSynthesizer":
@@ -157,19 +328,64 @@ class CircuitSynthesizer:
 
     def solve(self) -> Circuit | None:
         if self._circuit is None:
-            line_iter = range(self._width)
-            gate_iter = range(self._gate_count)
-            sat, literals = self._solver.solve(self._cnf)
-            controls = self._controls
-            targets = self._targets
-            if not sat:
-                self.circuit = None
-                return self.circuit
-            circuit = Circuit(self._width)
-            for gid in gate_iter:
-                g_controls = [lid for lid in line_iter if controls[gid][lid].value() in literals]
-                g_targets = [lid for lid in line_iter if targets[gid][lid].value() in literals]
-                assert len(g_targets) == 1
-                circuit.mcx(g_controls, g_targets[0])
-            self._circuit = circuit
+            self._circuit = self._solve([])
         return self._circuit
+
+    def solve_gate_count(self, gate_count: int) -> Circuit | None:
+        return self._solve(self.gate_count_assumptions(gate_count))
+
+    def _solve(self, assumptions: list[int]) -> Circuit | None:
+        sat, literals = self._solver.solve(self._cnf, assumptions)
+        if sat is None:
+            raise TimeoutError(f"Solver {self._solver.name()} gave up within its limits")
+        if not sat:
+            return None
+        return self._decode(literals)
+
+    def _decode(self, literals: list[int]) -> Circuit:
+        line_iter = range(self._width)
+        controls = self._controls
+        targets = self._targets
+        literals = set(literals)
+        circuit = Circuit(self._width)
+        for gid in range(self._gate_count):
+            if self._optional_gates and self._enables[gid].value() not in literals:
+                continue
+            g_controls = [lid for lid in line_iter if controls[gid][lid].value() in literals]
+            g_targets = [lid for lid in line_iter if targets[gid][lid].value() in literals]
+            assert len(g_targets) == 1
+            circuit.mcx(g_controls, g_targets[0])
+        assert self._output.matches(circuit.tt())
+        return circuit
+
+    def cubes(self, depth: int = 1, first_gate: int = 0) -> list[list[int]]:
+        assert 0 <= depth and 0 <= first_gate and first_gate + depth <= self._gate_count
+        cubes: list[list[int]] = [[]]
+        for gid in range(first_gate, first_gate + depth):
+            gate_cubes = []
+            for target in range(self._width):
+                lines = [lid for lid in range(self._width) if lid != target]
+                for mask in range(1 << len(lines)):
+                    cube = [lit.value() if lid == target else -lit.value()
+                            for lid, lit in enumerate(self._targets[gid])]
+                    cube += [self._controls[gid][lid].value() * (1 if mask >> i & 1 else -1)
+                             for i, lid in enumerate(lines)]
+                    cube.append(-self._controls[gid][target].value())
+                    gate_cubes.append(cube)
+            cubes = [prefix + cube for prefix in cubes for cube in gate_cubes]
+        return cubes
+
+    def solve_cubes(
+        self, workers: int, depth: int = 1, assumptions: list[int] = [], first_gate: int = 0
+    ) -> Circuit | None:
+        cubes = [assumptions + cube for cube in self.cubes(depth, first_gate)]
+        unknown = False
+        context = get_context("fork")  # workers inherit the CNF instead of unpickling it
+        with context.Pool(workers, _init_cube_worker, (self,)) as pool:
+            for sat, literals in pool.imap_unordered(_solve_cube, cubes):
+                if sat:
+                    return self._decode(literals)
+                unknown = unknown or sat is None
+        if unknown:
+            raise TimeoutError(f"Solver {self._solver.name()} gave up within its limits")
+        return None
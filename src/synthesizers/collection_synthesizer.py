@@ -1,29 +1,71 @@
 from circuit.collection import Collection
-from synthesizers.dimgroup_synthesizer import DimGroupSynthesizer
-from pickle import dump
-from os.path import join
+from circuit.dim_group import DimGroup
+from multiprocessing import Pool
+from sat.solver import Solver
+from synthesizers.dimgroup_synthesizer import DimGroupSynthesizer, WorkUnit
+from utils.shards import ShardStore
+
+# width, gate count, solver, incremental mode, work unit of the dim group
+Task = tuple[int, int, Solver | None, bool, WorkUnit]
+
+
+def _synthesize_task(task: Task) -> tuple[int, int, DimGroup]:
+    width, gc, solver, incremental, unit = task
+    return width, gc, DimGroupSynthesizer(width, gc, solver, incremental).synthesize(*unit)
 
 
 class CollectionSynthesizer:
-    def __init__(self, max_width: int, max_gate_count: int):
+    def __init__(
+        self,
+        max_width: int,
+        max_gate_count: int,
+        solver: Solver | None = None,
+        incremental: bool = False,
+    ):
         self._max_width = max_width
         self._max_gate_count = max_gate_count
+        self._solver = solver
+        self._incremental = incremental
         self._collection = Collection(max_width, max_gate_count)
-        self._save = False
+        self._store: ShardStore | None = None
+        self._resume = False
 
     def synthesize(self, threads_num: int = 1) -> Collection:
+        tasks = self._tasks()
+        remaining: dict[tuple[int, int], int] = {}
+        for width, gc, _, _, _ in tasks:
+            remaining[width, gc] = remaining.get((width, gc), 0) + 1
+            self._collection[width][gc] = DimGroup(width, gc)
+
+        chunksize = max(1, len(tasks) // (threads_num * 8))
+        with Pool(threads_num) as pool:
+            for width, gc, subgroup in pool.imap_unordered(_synthesize_task, tasks, chunksize):
+                self._collection[width][gc].join(subgroup)
+                remaining[width, gc] -= 1
+                if not remaining[width, gc] and self._store is not None:
+                    self._store.save(self._collection[width][gc])
+        return self._collection
+
+    def _tasks(self) -> list[Task]:
+        # heavy dim groups go first, small ones fill the gaps they leave behind
+        tasks = []
         for width in range(1, self._max_width + 1):
             for gc in range(2, self._max_gate_count + 1):
-                dgs = DimGroupSynthesizer(width, gc)
-                dimgroup = dgs.synthesize_mt(threads_num)
-                self._collection[width][gc] = dimgroup
-                if self._save:
-                    with open(f"{self._file_prefix}_{width}_{gc}.pickle", "wb") as f:
-                        dump(self._collection, f)
-        return self._collection
+                if self._restore(width, gc):
+                    continue
+                dgs = DimGroupSynthesizer(width, gc, self._solver, self._incremental)
+                for unit in dgs.work_units():
+                    weight = (width * gc, dgs.unit_weight(unit))
+                    tasks.append((weight, (width, gc, self._solver, self._incremental, unit)))
+        tasks.sort(key=lambda task: task[0], reverse=True)
+        return [task for _, task in tasks]
+
+    def _restore(self, width: int, gc: int) -> bool:
+        dimgroup = self._store.load(width, gc) if self._store and self._resume else None
+        if dimgroup is not None:
+            self._collection[width][gc] = dimgroup
+        return dimgroup is not None
 
-    def set_file_save(self, dir: str, collection_name: str) -> None:
-        self._dir = dir
-        self._collection_name = collection_name
-        self._file_prefix = join(dir, collection_name)
-        self._save = True
+    def set_file_save(self, dir: str, collection_name: str, resume: bool = False) -> None:
+        self._store = ShardStore(dir, collection_name)
+        self._resume = resume
@@ -3,17 +3,21 @@ from synthesizers.circuit_synthesizer import CircuitSynthesizer
 from truth_table.truth_table import TruthTable
 from circuit.circuit import Circuit
 from circuit.dim_group import DimGroup
+from math import comb
 from multiprocessing import Pool
 
+# global controls number, maximal controls number of a single gate
+WorkUnit = tuple[int, int]
+
 
 class PartialSynthesizer:
-    def __init__(self, width: int, gate_count: int):
+    def __init__(self, width: int, gate_count: int, solver: Solver | None = None):
         self._width = width
         self._gate_count = gate_count
         self._synthesizer = CircuitSynthesizer(
             TruthTable(width),
             self._gate_count,
-            solver=Solver("kissat")
+            solver=Solver("kissat") if solver is None else solver
         )
         self._synthesizer.disable_empty_lines()
         self._synthesizer.disable_full_control_lines()
@@ -29,23 +33,41 @@ class PartialSynthesizer:
         self._synthesizer.set_global_controls_num(controls_num)
         return self
 
+    def restrict_max_gate_controls(self, controls_num: int) -> "PartialSynthesizer":
+        self._synthesizer.set_max_gate_controls_num(controls_num)
+        return self
+
     def exclude_subcircuit(self, circuit: Circuit) -> "PartialSynthesizer":
         self._synthesizer.exclude_solution(circuit)
         return self
 
 
 class DimGroupSynthesizer:
-    def __init__(self, width: int, gate_count: int):
+    def __init__(
+        self,
+        width: int,
+        gate_count: int,
+        solver: Solver | None = None,
+        incremental: bool = False,
+    ):
         self._width = width
         self._gate_count = gate_count
+        self._incremental = incremental
+        if incremental:
+            solver = Solver("minisat-gh") if solver is None else solver
+            solver = solver.with_incremental()
+        self._solver = solver
 
-    def synthesize(self, controls_num: int | None = None) -> DimGroup:
-        cnum = controls_num
+    def synthesize(
+        self, controls_num: int | None = None, max_gate_controls: int | None = None
+    ) -> DimGroup:
+        if self._gate_count == 0:
+            return self._synthesize_empty(controls_num, max_gate_controls)
+        if self._incremental:
+            return self._synthesize_incremental(controls_num, max_gate_controls)
         dg = DimGroup(self._width, self._gate_count)
         while True:
-            ps = PartialSynthesizer(self._width, self._gate_count)
-            if cnum is not None:
-                ps.restrict_global_controls(cnum)
+            ps = self._partial_synthesizer(controls_num, max_gate_controls)
             for circuit in dg:
                 ps.exclude_subcircuit(circuit)
             partial_dg = ps.synthesize()
@@ -55,16 +77,68 @@ class DimGroupSynthesizer:
                 break
         return dg
 
-    def synthesize_mt(self, threads: int) -> DimGroup:
+    def _synthesize_empty(
+        self, controls_num: int | None = None, max_gate_controls: int | None = None
+    ) -> DimGroup:
+        # no gates leave nothing to encode, the empty circuit is the whole group
+        dg = DimGroup(self._width, 0)
+        if not controls_num and not max_gate_controls:
+            dg.append(Circuit(self._width))
+        return dg
+
+    def _synthesize_incremental(
+        self, controls_num: int | None = None, max_gate_controls: int | None = None
+    ) -> DimGroup:
+        ps = self._partial_synthesizer(controls_num, max_gate_controls)
+        dg = DimGroup(self._width, self._gate_count)
+        while True:
+            partial_dg = ps.synthesize()
+            if not partial_dg:
+                break
+            dg.join(partial_dg)
+            for circuit in partial_dg:
+                ps.exclude_subcircuit(circuit)
+        self._solver.release()
+        return dg
+
+    def _partial_synthesizer(
+        self, controls_num: int | None, max_gate_controls: int | None
+    ) -> PartialSynthesizer:
+        ps = PartialSynthesizer(self._width, self._gate_count, self._solver)
+        if controls_num is not None:
+            ps.restrict_global_controls(controls_num)
+        if max_gate_controls is not None:
+            ps.restrict_max_gate_controls(max_gate_controls)
+        return ps
+
+    def work_units(self) -> list[WorkUnit]:
+        # both numbers are invariant under unroll(), so units never share a circuit class
         width = self._width
         gate_count = self._gate_count
-        max_controls_num = (width - 1) * gate_count
-        controls_num_range = range(max_controls_num + 1)
+        if gate_count == 0:
+            return [(0, 0)]
+        units = []
+        for controls_num in range((width - 1) * gate_count + 1):
+            lowest = -(-controls_num // gate_count)
+            for max_gate_controls in range(lowest, min(width - 1, controls_num) + 1):
+                units.append((controls_num, max_gate_controls))
+        units.sort(key=self.unit_weight, reverse=True)
+        return units
 
-        with Pool(threads) as pool:
-            results = list(pool.map(self.synthesize, controls_num_range))
+    def unit_weight(self, unit: WorkUnit) -> int:
+        controls_num, max_gate_controls = unit
+        free = (self._width - 1) * (self._gate_count - 1)
+        return comb(free, controls_num - max_gate_controls)
+
+    def _synthesize_unit(self, unit: WorkUnit) -> DimGroup:
+        return self.synthesize(*unit)
+
+    def synthesize_mt(self, threads: int) -> DimGroup:
+        units = self.work_units()
+        chunksize = max(1, len(units) // (threads * 8))
 
         dg = DimGroup(self._width, self._gate_count)
-        for subgroup in results:
-            dg.join(subgroup)
+        with Pool(threads) as pool:
+            for subgroup in pool.imap_unordered(self._synthesize_unit, units, chunksize):
+                dg.join(subgroup)
         return dg
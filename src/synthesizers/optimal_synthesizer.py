@@ -1,16 +1,38 @@
 from circuit.circuit import Circuit
 from circuit.collection import Collection
+from circuit.tt_index import TruthTableIndex, Variant, canonical_variant, restore_variant
+from collections.abc import Iterable, Iterator
+from multiprocessing import get_context
 from truth_table.truth_table import TruthTable
 from sat.solver import Solver
 from synthesizers.circuit_synthesizer import CircuitSynthesizer
 
+# representative table, lower gate count, upper gate count, solver, options
+BatchTask = tuple[TruthTable, int, int, Solver, dict]
+
+
+def _solve_batch_task(task: BatchTask) -> tuple[tuple[int, int], Circuit | None]:
+    output, lower_gc, upper_gc, solver, options = task
+    return output.key(), OptimalSynthesizer(output, lower_gc, upper_gc, solver, **options).solve()
+
 
 class OptimalSynthesizer:
-    def __init__(self, output: TruthTable, lower_gc: int, upper_gc: int, solver: Solver):
+    def __init__(
+        self,
+        output: TruthTable,
+        lower_gc: int,
+        upper_gc: int,
+        solver: Solver,
+        incremental: bool = False,
+        symmetry_breaking: bool = False,
+        cube_workers: int = 0,
+        cube_depth: int = 1,
+    ):
         assert len(output) >= 2
         assert len(output) == pow(2, len(output[0]))
         assert all(len(word) == len(output[0]) for word in output)
         assert upper_gc >= lower_gc
+        assert cube_workers >= 0 and cube_depth >= 1
 
         self._output = output
         self._lower_gc = lower_gc
@@ -20,20 +42,114 @@ class OptimalSynthesizer:
         self._words = len(output)
         self._circuit = None
         self._exc_collection = None
+        self._index: TruthTableIndex | None = None
+        self._incremental = incremental
+        self._symmetry_breaking = symmetry_breaking
+        self._cube_workers = cube_workers
+        self._cube_depth = cube_depth
+        if incremental and solver.name() in Solver.builtin_solvers:
+            self._solver = solver.with_incremental()
 
     def exclude_collection(self, collection: Collection) -> "OptimalSynthesizer":
         self._exc_collection = collection
         return self
 
+    def use_index(self, index: TruthTableIndex) -> "OptimalSynthesizer":
+        self._index = index
+        return self
+
     def solve(self) -> Circuit | None:
         if self._circuit is not None:
             return self._circuit
+        if self._index is not None:
+            circuit = self._index.lookup(self._output)
+            if circuit is not None and self._lower_gc <= len(circuit) <= self._upper_gc:
+                self._circuit = circuit
+                return circuit
+        if self._incremental:
+            circuit = self._solve_incremental()
+        else:
+            circuit = self._solve_levels()
+        if circuit is not None and self._index is not None and self._proven_optimal():
+            self._index.add(circuit)
+        return circuit
+
+    def _proven_optimal(self) -> bool:
+        # a search starting above zero gates or skipping excluded circuits proves no optimum
+        return self._lower_gc == 0 and not self._exc_collection
+
+    def _make_synthesizer(self, gc: int, optional_gates: bool = False) -> CircuitSynthesizer:
+        c_synth = CircuitSynthesizer(self._output, gc, self._solver, optional_gates)
+        if self._exc_collection:
+            c_synth.exclude_collection(self._exc_collection)
+        if self._symmetry_breaking:
+            c_synth.disable_identical_adjacent_gates()
+            c_synth.order_commuting_gates()
+        return c_synth
+
+    def _solve_synthesizer(
+        self, c_synth: CircuitSynthesizer, gc: int, assumptions: list[int]
+    ) -> Circuit | None:
+        # cubes split the first enabled gates, too few gates leave nothing to split
+        depth = min(self._cube_depth, gc)
+        if self._cube_workers and depth:
+            first_gate = c_synth._gate_count - gc
+            return c_synth.solve_cubes(self._cube_workers, depth, assumptions, first_gate)
+        return c_synth._solve(assumptions)
+
+    def _solve_levels(self) -> Circuit | None:
         for gc in range(self._lower_gc, self._upper_gc + 1):
-            c_synth = CircuitSynthesizer(self._output, gc, self._solver)
-            if self._exc_collection:
-                c_synth.exclude_collection(self._exc_collection)
-            circuit = c_synth.solve()
+            c_synth = self._make_synthesizer(gc)
+            circuit = self._solve_synthesizer(c_synth, gc, [])
             if circuit is not None:
                 self._circuit = circuit
                 return circuit
         return None
+
+    def _solve_incremental(self) -> Circuit | None:
+        c_synth = self._make_synthesizer(self._upper_gc, optional_gates=True)
+        for gc in range(self._lower_gc, self._upper_gc + 1):
+            assumptions = c_synth.gate_count_assumptions(gc)
+            circuit = self._solve_synthesizer(c_synth, gc, assumptions)
+            if circuit is not None:
+                self._circuit = circuit
+                break
+        self._solver.release()
+        return self._circuit
+
+    @staticmethod
+    def solve_many(
+        tables: Iterable[TruthTable],
+        lower_gc: int,
+        upper_gc: int,
+        solver: Solver,
+        workers: int = 1,
+        **options,
+    ) -> Iterator[tuple[int, Circuit | None]]:
+        # tables equal up to line permutation and inversion share one synthesis
+        classes: dict[tuple[int, int], list[tuple[int, Variant]]] = {}
+        tasks: list[BatchTask] = []
+        for index, tt in enumerate(tables):
+            representative, variant = canonical_variant(tt)
+            if representative.key() not in classes:
+                classes[representative.key()] = []
+                tasks.append((representative, lower_gc, upper_gc, solver, options))
+            classes[representative.key()].append((index, variant))
+
+        # cube workers are a pool of their own, which daemonic batch workers cannot start
+        if workers == 1 or options.get("cube_workers"):
+            results = map(_solve_batch_task, tasks)
+            yield from OptimalSynthesizer._restore_batch(results, classes)
+            return
+        with get_context("fork").Pool(workers) as pool:  # workers skip re-importing pysat
+            results = pool.imap_unordered(_solve_batch_task, tasks)
+            yield from OptimalSynthesizer._restore_batch(results, classes)
+
+    @staticmethod
+    def _restore_batch(
+        results: Iterable[tuple[tuple[int, int], Circuit | None]],
+        classes: dict[tuple[int, int], list[tuple[int, Variant]]],
+    ) -> Iterator[tuple[int, Circuit | None]]:
+        for key, circuit in results:
+            for index, variant in classes[key]:
+                yield index, None if circuit is None else restore_variant(circuit, variant)
@@ -0,0 +1,148 @@
+import json
+import os
+from argparse import ArgumentParser
+from os.path import exists, join
+from time import sleep, time
+from circuit.dim_group import DimGroup
+from sat.solver import Solver
+from synthesizers.dimgroup_synthesizer import DimGroupSynthesizer
+from utils.dump import dimgroup_dump_bin
+from utils.load import dimgroup_load_bin
+
+# spool layout: todo/<task>.json -> claimed/<task>.json -> done/<task>.bin
+
+
+def _task_name(width: int, gate_count: int, unit: tuple[int, int]) -> str:
+    return f"{width}_{gate_count}_{unit[0]}_{unit[1]}"
+
+
+def _write_atomic(file_name: str, text: str) -> None:
+    with open(file_name + ".tmp", "w") as file:
+        file.write(text)
+    os.replace(file_name + ".tmp", file_name)
+
+
+class SpoolCoordinator:
+    def __init__(self, spool_dir: str):
+        self._dir = spool_dir
+        for state in ("todo", "claimed", "done"):
+            os.makedirs(join(spool_dir, state), exist_ok=True)
+
+    def submit(
+        self,
+        width: int,
+        gate_count: int,
+        solver_name: str | None = None,
+        incremental: bool = False,
+    ) -> list[str]:
+        names = []
+        for unit in DimGroupSynthesizer(width, gate_count).work_units():
+            name = _task_name(width, gate_count, unit)
+            task = {
+                "width": width,
+                "gate_count": gate_count,
+                "unit": unit,
+                "solver": solver_name,
+                "incremental": incremental,
+            }
+            if not any(
+                exists(join(self._dir, state, name + suffix))
+                for state, suffix in (("done", ".bin"), ("claimed", ".json"))
+            ):
+                _write_atomic(join(self._dir, "todo", name + ".json"), json.dumps(task))
+            names.append(name)
+        return names
+
+    def requeue_stale(self, timeout: float) -> int:
+        requeued = 0
+        claimed = join(self._dir, "claimed")
+        for entry in os.scandir(claimed):
+            if entry.name.endswith(".json") and time() - entry.stat().st_mtime > timeout:
+                try:
+                    os.rename(entry.path, join(self._dir, "todo", entry.name))
+                    requeued += 1
+                except FileNotFoundError:
+                    pass  # finished in the meantime
+        return requeued
+
+    def collect(
+        self, width: int, gate_count: int, poll: float = 0.1, stale_timeout: float | None = None
+    ) -> DimGroup:
+        units = DimGroupSynthesizer(width, gate_count).work_units()
+        names = [_task_name(width, gate_count, unit) for unit in units]
+        results = [join(self._dir, "done", name + ".bin") for name in names]
+        while not all(exists(result) for result in results):
+            if stale_timeout is not None:
+                self.requeue_stale(stale_timeout)
+            sleep(poll)
+        dimgroup = DimGroup(width, gate_count)
+        for result in results:
+            dimgroup.join(dimgroup_load_bin(result))
+        dimgroup.remove_duplicates()
+        return dimgroup
+
+
+class SpoolWorker:
+    def __init__(self, spool_dir: str, solver: Solver | None = None):
+        self._dir = spool_dir
+        self._solver = solver
+        self._done = 0
+
+    def done(self) -> int:
+        return self._done
+
+    def claim(self) -> tuple[str, dict] | None:
+        todo = join(self._dir, "todo")
+        for entry in sorted(os.scandir(todo), key=lambda entry: entry.name):
+            if not entry.name.endswith(".json"):
+                continue
+            claimed = join(self._dir, "claimed", entry.name)
+            try:
+                os.rename(entry.path, claimed)  # atomic, only one worker wins
+            except FileNotFoundError:
+                continue
+            os.utime(claimed)
+            with open(claimed) as file:
+                return entry.name[:-len(".json")], json.load(file)
+        return None
+
+    def run_one(self) -> bool:
+        claim = self.claim()
+        if claim is None:
+            return False
+        name, task = claim
+        solver = self._solver
+        if solver is None and task["solver"] is not None:
+            solver = Solver(task["solver"])
+        incremental = task.get("incremental", False)  # tasks spooled before the flag existed
+        dgs = DimGroupSynthesizer(task["width"], task["gate_count"], solver, incremental)
+        dimgroup = dgs.synthesize(*task["unit"])
+        result = join(self._dir, "done", name + ".bin")
+        dimgroup_dump_bin(dimgroup, result + ".tmp")
+        os.replace(result + ".tmp", result)
+        try:
+            os.remove(join(self._dir, "claimed", name + ".json"))
+        except FileNotFoundError:
+            pass  # requeued as stale, the duplicate result is harmless
+        self._done += 1
+        return True
+
+    def run(self, idle_timeout: float = 0.0, poll: float = 0.1) -> int:
+        idle_since = time()
+        while True:
+            if self.run_one():
+                idle_since = time()
+            elif time() - idle_since >= idle_timeout:
+                return self._done
+            else:
+                sleep(poll)
+
+
+if __name__ == "__main__":
+    parser = ArgumentParser(description="Synthesize dim group work units from a spool")
+    parser.add_argument("spool_dir")
+    parser.add_argument("--solver", default=None)
+    parser.add_argument("--idle-timeout", type=float, default=60.0)
+    args = parser.parse_args()
+    solver = None if args.solver is None else Solver(args.solver)
+    SpoolWorker(args.spool_dir, solver).run(args.idle_timeout)
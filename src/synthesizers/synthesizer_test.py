@@ -1,8 +1,20 @@
+import os
 import pytest
 from random import randint, sample
 from sat.solver import Solver
+from sat.portfolio import PortfolioSolver
 from truth_table.truth_table import TruthTable
+from synthesizers import circuit_synthesizer
 from synthesizers.circuit_synthesizer import CircuitSynthesizer
+from synthesizers.dimgroup_synthesizer import DimGroupSynthesizer
+from synthesizers.optimal_synthesizer import OptimalSynthesizer
+from circuit.circuit import Circuit
+from circuit.tt_index import TruthTableIndex
+from synthesizers.template_cache import TemplateCache
+from synthesizers.collection_synthesizer import CollectionSynthesizer
+from synthesizers.spool import SpoolCoordinator, SpoolWorker
+from utils.shards import ShardStore
+from multiprocessing import Process
 
 
 solver_names = Solver.builtin_solvers
@@ -86,3 +98,297 @@ def test_single_mcx(solver, identity_tt, mcx_params):
     controls, target = circuit[0]
     assert controls == sorted(mcx_params[0])
     assert target == mcx_params[1]
+
+
+@pytest.mark.parametrize("width, gate_count", [(2, 4), (3, 4), (2, 6), (3, 5)])
+def test_dimgroup_incremental(width, gate_count):
+    reference = DimGroupSynthesizer(width, gate_count, Solver("minisat-gh")).synthesize()
+    incremental = DimGroupSynthesizer(width, gate_count, incremental=True).synthesize()
+    assert len(incremental) == len(reference)
+    assert all(circuit in incremental._circuits for circuit in reference)
+
+
+def test_dimgroup_incremental_solver():
+    synthesizer = DimGroupSynthesizer(3, 4, Solver("glucose4", conflict_limit=10**6), True)
+    assert synthesizer._solver.incremental() and synthesizer._solver.name() == "glucose4"
+    reference = DimGroupSynthesizer(3, 4, incremental=True).synthesize()
+    assert len(synthesizer.synthesize()) == len(reference)
+    assert synthesizer._solver.session() is None
+    with pytest.raises(ValueError):
+        DimGroupSynthesizer(3, 4, Solver("kissat"), incremental=True)
+
+
+@pytest.mark.parametrize("solver_name", ["minisat-gh", "cadical153", "glucose4"])
+@pytest.mark.parametrize("bits_num", [randint(2, 3) for _ in range(4)])
+def test_optimal_incremental(solver_name, bits_num):
+    tt = TruthTable(bits_num).shuffle()
+    reference = OptimalSynthesizer(tt, 0, 8, Solver(solver_name)).solve()
+    circuit = OptimalSynthesizer(tt, 0, 8, Solver(solver_name), incremental=True).solve()
+    assert reference is not None and circuit is not None
+    assert len(circuit) == len(reference)
+    assert circuit.tt() == tt
+
+
+def test_optimal_incremental_limits():
+    tt = TruthTable(4).shuffle()
+    solver = Solver("minisat-gh", conflict_limit=1)
+    synthesizer = OptimalSynthesizer(tt, 8, 8, solver, incremental=True)
+    assert synthesizer._solver.incremental()
+    with pytest.raises(TimeoutError):
+        synthesizer.solve()
+
+
+@pytest.mark.parametrize("bits_num", [randint(2, 3) for _ in range(4)])
+def test_optimal_index(bits_num):
+    index = TruthTableIndex()
+    tt = TruthTable(bits_num).shuffle()
+    circuit = OptimalSynthesizer(tt, 0, 8, Solver("minisat-gh")).use_index(index).solve()
+    assert circuit is not None
+    assert tt in index
+    permutation = sample(range(bits_num), bits_num)
+    equivalent_tt = tt.permute(permutation, inplace=False).inverse()
+    assert equivalent_tt not in index or equivalent_tt == tt
+    found = index.lookup(equivalent_tt)
+    assert found is not None
+    assert len(found) == len(circuit)
+    assert found.tt() == equivalent_tt
+    cached = OptimalSynthesizer(equivalent_tt, 0, 8, Solver("minisat-gh")).use_index(index)
+    assert cached.solve() == found
+
+
+def test_optimal_index_lower_bound():
+    index = TruthTableIndex()
+    tt = TruthTable(3).x(0)
+    bounded = OptimalSynthesizer(tt, 3, 8, Solver("minisat-gh")).use_index(index).solve()
+    assert bounded is not None and len(bounded) == 3
+    assert tt not in index
+    circuit = OptimalSynthesizer(tt, 0, 8, Solver("minisat-gh")).use_index(index).solve()
+    assert circuit is not None and len(circuit) == 1
+    assert tt in index
+
+
+@pytest.mark.parametrize("bits_num", [randint(2, 4) for _ in range(epochs // 8)])
+def test_template_cache(bits_num):
+    cache = TemplateCache(max_entries=2)
+    solver = Solver("minisat-gh")
+    tt = TruthTable(bits_num).shuffle()
+    first = CircuitSynthesizer(tt, 3, solver, cache=cache)
+    assert (cache.hits(), cache.misses()) == (0, 1)
+    circuit = first.solve()
+    if circuit is not None:
+        first.exclude_solution(circuit)
+    other_tt = TruthTable(bits_num).x(0).cx(1, 0)
+    second = CircuitSynthesizer(other_tt, 3, solver, cache=cache)
+    assert (cache.hits(), cache.misses()) == (1, 1)
+    excluded = int(circuit is not None)
+    assert second._cnf.clauses_num() == first._cnf.clauses_num() - excluded
+    circuit = second.solve()
+    assert circuit is not None and circuit.tt() == other_tt
+    CircuitSynthesizer(tt, 1, solver, cache=cache)
+    CircuitSynthesizer(tt, 2, solver, cache=cache)
+    assert len(cache) == 2
+    assert (bits_num, 3, False, "direct", "seqcounter") not in cache
+
+
+@pytest.mark.parametrize("incremental", [False, True])
+@pytest.mark.parametrize("bits_num", [randint(2, 3) for _ in range(epochs // 8)])
+def test_optimal_symmetry_breaking(bits_num, incremental):
+    tt = TruthTable(bits_num).shuffle()
+    reference = OptimalSynthesizer(tt, 0, 8, Solver("cadical153")).solve()
+    synthesizer = OptimalSynthesizer(
+        tt, 0, 8, Solver("cadical153"), incremental=incremental, symmetry_breaking=True
+    )
+    circuit = synthesizer.solve()
+    assert reference is not None and circuit is not None
+    assert len(circuit) == len(reference)
+    assert circuit.tt() == tt
+    gates = circuit.gates()
+    for gid in range(len(circuit) - 1):
+        (_, lhs_target), (_, rhs_target) = gates[gid], gates[gid + 1]
+        assert gates[gid] != gates[gid + 1]
+        if circuit.gate_swappable(gid):
+            assert lhs_target <= rhs_target
+
+
+@pytest.mark.parametrize("xor_encoding", ["direct", "chain"])
+@pytest.mark.parametrize("bits_num", [randint(2, 3) for _ in range(epochs // 8)])
+def test_xor_encoding(bits_num, xor_encoding):
+    tt = TruthTable(bits_num).shuffle()
+    synthesizer = CircuitSynthesizer(tt, 8, Solver("cadical153"), xor_encoding=xor_encoding)
+    assert synthesizer._cnf.xor_encoding() == xor_encoding
+    circuit = synthesizer.solve()
+    assert circuit is not None
+    assert circuit.tt() == tt
+    native = CircuitSynthesizer(tt, 8, Solver("cadical153"), xor_encoding="native")
+    assert native._cnf.xors_num() == len(tt) * 8 * bits_num
+
+
+@pytest.mark.parametrize("bits_num", [randint(2, 3) for _ in range(4)])
+def test_optimal_portfolio(bits_num):
+    tt = TruthTable(bits_num).shuffle()
+    reference = OptimalSynthesizer(tt, 0, 8, Solver("cadical153")).solve()
+    portfolio = PortfolioSolver(["cadical153", "minisat-gh", "glucose4"])
+    circuit = OptimalSynthesizer(tt, 0, 8, portfolio).solve()
+    assert reference is not None and circuit is not None
+    assert len(circuit) == len(reference)
+    assert circuit.tt() == tt
+
+
+@pytest.mark.parametrize("_", range(4))
+def test_solver_limits(_):
+    tt = TruthTable(4).shuffle()
+    synthesizer = CircuitSynthesizer(tt, 8, Solver("minisat-gh", conflict_limit=1))
+    with pytest.raises(TimeoutError):
+        synthesizer.solve()
+
+
+@pytest.mark.parametrize("width, gate_count", [(1, 3), (2, 4), (3, 4), (2, 6), (3, 5)])
+def test_dimgroup_work_units(width, gate_count):
+    synthesizer = DimGroupSynthesizer(width, gate_count, Solver("minisat-gh"))
+    reference = synthesizer.synthesize()
+    parallel = synthesizer.synthesize_mt(4)
+    assert len(parallel) == len(reference)
+    assert all(circuit in parallel._circuits for circuit in reference)
+
+
+@pytest.mark.parametrize("incremental", [False, True])
+def test_dimgroup_no_gates(incremental):
+    synthesizer = DimGroupSynthesizer(3, 0, Solver("minisat-gh"), incremental)
+    assert synthesizer.work_units() == [(0, 0)]
+    for dimgroup in (synthesizer.synthesize(), synthesizer.synthesize(0, 0),
+                     synthesizer.synthesize_mt(2)):
+        assert list(map(str, dimgroup)) == [str(Circuit(3))]
+    assert not synthesizer.synthesize(1)
+
+
+def test_collection_resume(tmp_path):
+    synthesizer = CollectionSynthesizer(2, 4, Solver("minisat-gh"))
+    synthesizer.set_file_save(str(tmp_path), "collection")
+    reference = synthesizer.synthesize()
+    shard = ShardStore(str(tmp_path), "collection").shard_path(2, 3)
+    os.remove(shard)
+
+    resumed = CollectionSynthesizer(2, 4, Solver("minisat-gh"))
+    resumed.set_file_save(str(tmp_path), "collection", resume=True)
+    collection = resumed.synthesize()
+    assert os.path.exists(shard)
+    for width in range(1, 3):
+        for gc in range(2, 5):
+            assert sorted(map(str, collection[width][gc])) == sorted(map(str, reference[width][gc]))
+
+
+@pytest.mark.parametrize("incremental", [False, True])
+def test_collection_parallel(incremental):
+    collection = CollectionSynthesizer(3, 4, Solver("minisat-gh"), incremental).synthesize(4)
+    for width in range(1, 4):
+        for gc in range(2, 5):
+            reference = DimGroupSynthesizer(width, gc, Solver("minisat-gh")).synthesize()
+            assert sorted(map(str, collection[width][gc])) == sorted(map(str, reference))
+
+
+def _spool_worker(spool_dir):
+    SpoolWorker(spool_dir).run(idle_timeout=1.0)
+
+
+@pytest.mark.parametrize("width, gate_count", [(2, 4), (3, 5)])
+@pytest.mark.parametrize("incremental", [False, True])
+def test_spool(width, gate_count, incremental, tmp_path):
+    coordinator = SpoolCoordinator(str(tmp_path))
+    coordinator.submit(width, gate_count, "minisat-gh", incremental)
+    workers = [Process(target=_spool_worker, args=(str(tmp_path),)) for _ in range(3)]
+    for worker in workers:
+        worker.start()
+    dimgroup = coordinator.collect(width, gate_count, poll=0.01)
+    for worker in workers:
+        worker.join()
+    reference = DimGroupSynthesizer(width, gate_count, Solver("minisat-gh")).synthesize()
+    assert sorted(map(str, dimgroup)) == sorted(map(str, reference))
+    assert not os.listdir(tmp_path / "todo") and not os.listdir(tmp_path / "claimed")
+
+
+@pytest.mark.parametrize("bits_num", [randint(2, 3) for _ in range(4)])
+@pytest.mark.parametrize("incremental", [False, True])
+def test_optimal_cubes(bits_num, incremental):
+    tt = TruthTable(bits_num).shuffle()
+    reference = OptimalSynthesizer(tt, 0, 8, Solver("minisat-gh")).solve()
+    synthesizer = OptimalSynthesizer(
+        tt, 0, 8, Solver("minisat-gh"), incremental, cube_workers=4, cube_depth=2
+    )
+    circuit = synthesizer.solve()
+    assert reference is not None and circuit is not None
+    assert len(circuit) == len(reference)
+    assert circuit.tt() == tt
+
+
+@pytest.mark.parametrize("depth", [1, 2])
+def test_cubes(depth):
+    synthesizer = CircuitSynthesizer(TruthTable(3), 4, Solver("minisat-gh"))
+    cubes = synthesizer.cubes(depth)
+    assert len(cubes) == (3 * 4) ** depth
+    assert len({tuple(sorted(cube)) for cube in cubes}) == len(cubes)
+    assert all(len(cube) == 6 * depth for cube in cubes)
+
+
+def test_cubes_first_gate():
+    synthesizer = CircuitSynthesizer(TruthTable(3), 4, Solver("minisat-gh"))
+    gate_vars = {lit.value() for lit in synthesizer._targets[2] + synthesizer._controls[2]}
+    cubes = synthesizer.cubes(1, 2)
+    assert len(cubes) == 3 * 4
+    assert all(abs(lit) in gate_vars for cube in cubes for lit in cube)
+    with pytest.raises(AssertionError):
+        synthesizer.cubes(2, 3)
+
+
+def test_cube_worker_session():
+    tt = TruthTable(3).shuffle()
+    synthesizer = CircuitSynthesizer(tt, 8, Solver("minisat-gh"))
+    circuit_synthesizer._init_cube_worker(synthesizer)
+    solver = circuit_synthesizer._cube_solver
+    assert solver is not None and solver.incremental()
+    cubes = synthesizer.cubes(1)
+    circuit_synthesizer._solve_cube(cubes[0])
+    session = solver.session()
+    circuit_synthesizer._solve_cube(cubes[1])
+    assert session is not None and solver.session() is session
+    solver.release()
+
+
+@pytest.mark.parametrize("workers", [1, 3])
+def test_optimal_solve_many(workers):
+    tables = []
+    for _ in range(4):
+        tt = TruthTable(3).shuffle()
+        tables += [tt, tt.inverse(inplace=False), tt.permute(sample(range(3), 3), inplace=False)]
+    results = dict(OptimalSynthesizer.solve_many(tables, 0, 8, Solver("minisat-gh"), workers))
+    assert sorted(results) == list(range(len(tables)))
+    for index, tt in enumerate(tables):
+        reference = OptimalSynthesizer(tt, 0, 8, Solver("minisat-gh")).solve()
+        assert reference is not None and results[index] is not None
+        assert results[index].tt() == tt
+        assert len(results[index]) == len(reference)
+
+
+def test_optimal_solve_many_cubes():
+    tables = [TruthTable(3).shuffle() for _ in range(3)]
+    results = dict(OptimalSynthesizer.solve_many(
+        tables, 0, 8, Solver("minisat-gh"), 2, cube_workers=2
+    ))
+    for index, tt in enumerate(tables):
+        assert results[index] is not None and results[index].tt() == tt
+
+
+def test_optimal_solve_many_portfolio():
+    tables = [TruthTable(3).shuffle() for _ in range(3)]
+    portfolio = PortfolioSolver(["minisat-gh", "cadical153"])
+    results = dict(OptimalSynthesizer.solve_many(tables, 0, 8, portfolio, 2))
+    for index, tt in enumerate(tables):
+        assert results[index] is not None and results[index].tt() == tt
+
+
+def test_partial_output():
+    tt = TruthTable(2, bits=[[0, 0], [1, 0], [0, 1], [-1, -1]])
+    circuit = CircuitSynthesizer(tt, 2, Solver("minisat-gh")).solve()
+    assert circuit is not None and tt.matches(circuit.tt())
+    assert CircuitSynthesizer(tt, 1, Solver("minisat-gh")).solve() is None
+    circuit = OptimalSynthesizer(tt, 0, 4, Solver("minisat-gh")).solve()
+    assert circuit is not None and len(circuit) == 0
@@ -0,0 +1,68 @@
+from collections import OrderedDict
+from copy import copy
+from sat.cnf import CNF
+
+
+# width, gate count, optional gates, XOR encoding, cardinality encoding
+TemplateKey = tuple[int, int, bool, str, str]
+Template = tuple[CNF, dict[str, int]]  # skeleton CNF, variable block bases
+
+
+class TemplateCache:
+    def __init__(self, max_entries: int = 32, max_literals: int = 1 << 26):
+        assert max_entries > 0 and max_literals > 0
+        self._max_entries = max_entries
+        self._max_literals = max_literals
+        self._entries: OrderedDict[TemplateKey, Template] = OrderedDict()
+        self._literals_num = 0
+        self._hits = 0
+        self._misses = 0
+
+    def __len__(self) -> int:
+        return len(self._entries)
+
+    def __contains__(self, key: TemplateKey) -> bool:
+        return key in self._entries
+
+    def __str__(self) -> str:
+        return (
+            f"templates: {len(self)}, literals: {self._literals_num}, "
+            f"hits: {self._hits}, misses: {self._misses}"
+        )
+
+    def hits(self) -> int:
+        return self._hits
+
+    def misses(self) -> int:
+        return self._misses
+
+    def get(self, key: TemplateKey) -> Template | None:
+        if key not in self._entries:
+            self._misses += 1
+            return None
+        self._hits += 1
+        self._entries.move_to_end(key)
+        cnf, bases = self._entries[key]
+        return copy(cnf), bases
+
+    def put(self, key: TemplateKey, template: Template) -> None:
+        if key in self._entries:
+            self._evict(key)
+        cnf, bases = template
+        self._entries[key] = (copy(cnf), dict(bases))
+        self._literals_num += len(cnf.literals())
+        while len(self._entries) > 1 and (
+            len(self._entries) > self._max_entries or self._literals_num > self._max_literals
+        ):
+            self._evict(next(iter(self._entries)))
+
+    def clear(self) -> None:
+        self._entries.clear()
+        self._literals_num = 0
+
+    def _evict(self, key: TemplateKey) -> None:
+        cnf, _ = self._entries.pop(key)
+        self._literals_num -= len(cnf.literals())
+
+
+template_cache = TemplateCache()
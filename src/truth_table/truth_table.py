@@ -1,7 +1,6 @@
 from collections.abc import Iterable
 from random import shuffle
 from utils.inplace import inplace
-from copy import copy
 
 
 class TruthTable:
@@ -14,51 +13,96 @@ class TruthTable:
         rows_num = 2**bits_num
         assert values is None or bits is None
 
+        # per line mask of specified rows, None when every bit is specified
+        self._care: list[int] | None = None
         if bits is None:
             values = list(range(rows_num)) if values is None else values
             assert len(values) == rows_num
-            bits = [self.value_to_row(row, bits_num) for row in values]
         else:
             assert len(bits) == rows_num
             assert all(len(row) == bits_num for row in bits)
+            values = [self.row_to_value([b == 1 for b in row]) for row in bits]
+            care = [self.row_to_value([b in (0, 1) for b in row]) for row in bits]
+            if any(c != (1 << bits_num) - 1 for c in care):
+                self._care = self.values_to_planes(care, bits_num)
 
-        self._bits = bits
         self._bits_num = bits_num
+        self._full = (1 << rows_num) - 1
+        self._planes = self.values_to_planes(values, bits_num)
 
-    def values(self):
-        return [self.row_to_value(row) for row in self._bits]
+    def values(self) -> list[int]:
+        return self.planes_to_values(self._planes, len(self))
 
     def bits_num(self):
         return self._bits_num
 
-    def bits(self):
-        return self._bits
+    def bits(self) -> list[list[int]]:
+        return [self[r_id] for r_id in range(len(self))]
+
+    def planes(self) -> list[int]:
+        return self._planes
+
+    def care_planes(self) -> list[int]:
+        return [self._full] * self._bits_num if self._care is None else self._care
+
+    def complete(self) -> bool:
+        return self._care is None
+
+    def matches(self, other: "TruthTable") -> bool:
+        assert self._bits_num == other._bits_num
+        cares = zip(self._planes, other._planes, self.care_planes(), other.care_planes())
+        return all(not (lhs ^ rhs) & lc & rc for lhs, rhs, lc, rc in cares)
 
     def __copy__(self):
-        return TruthTable(self._bits_num, bits=[copy(row) for row in self.bits()])
+        new = TruthTable.__new__(TruthTable)
+        new._bits_num = self._bits_num
+        new._full = self._full
+        new._planes = self._planes[:]
+        new._care = None if self._care is None else self._care[:]
+        return new
 
     def __eq__(self, other):
-        lhs = (self._bits_num, self._bits)
-        rhs = (other._bits_num, other._bits)
+        lhs = (self._bits_num, self._planes, self._care)
+        rhs = (other._bits_num, other._planes, other._care)
         return lhs == rhs
 
+    def __hash__(self):
+        return hash(self.key())
+
+    def key(self) -> tuple[int, int]:
+        return (self._bits_num, self.packed())
+
+    def packed(self) -> int:
+        rows_num = len(self)
+        packed = 0
+        for i, plane in enumerate(self._planes + (self._care or [])):
+            packed |= plane << (i * rows_num)
+        return packed
+
     def __len__(self):
-        return len(self._bits)
+        return 1 << self._bits_num
 
     def __add__(self, other):
         assert len(self) == len(other)
-        new_values = [other.values()[v] for v in self.values()]
+        other_values = other.values()
+        new_values = [other_values[v] for v in self.values()]
         return TruthTable(self._bits_num, new_values)
 
     def __str__(self):
         header = f"bits = {self._bits_num}, rows = {len(self)}\n\n"
         rows = "\n".join(
-            [str(i) + ": " + str(row) for i, row in zip(self.values(), self._bits)]
+            [str(i) + ": " + str(row) for i, row in zip(self.values(), self.bits())]
         )
         return header + rows
 
     def __getitem__(self, key):
-        return self._bits[key]
+        if not -len(self) <= key < len(self):
+            raise IndexError("TruthTable row index out of range")
+        key %= len(self)
+        return [
+            plane >> key & 1 if care >> key & 1 else -1
+            for plane, care in zip(self._planes, self.care_planes())
+        ]
 
     @staticmethod
     def row_to_value(row: list[int]) -> int:
@@ -71,41 +115,74 @@ class TruthTable:
     def value_to_row(value: int, bits_num: int) -> list[int]:
         return [(value >> s) & 1 for s in range(bits_num)]
 
+    @staticmethod
+    def values_to_planes(values: list[int], bits_num: int) -> list[int]:
+        planes = [0] * bits_num
+        for r_id, value in enumerate(values):
+            for i in range(bits_num):
+                if value >> i & 1:
+                    planes[i] |= 1 << r_id
+        return planes
+
+    @staticmethod
+    def planes_to_values(planes: list[int], rows_num: int) -> list[int]:
+        values = [0] * rows_num
+        for i, plane in enumerate(planes):
+            bit = 1 << i
+            while plane:
+                low = plane & -plane
+                values[low.bit_length() - 1] |= bit
+                plane ^= low
+        return values
+
     @inplace
     def x(self, target: int, **_):
-        for row in self._bits:
-            row[target] = 1 - row[target]
+        self._planes[target] ^= self.care_planes()[target]
         return self
 
     @inplace
     def cx(self, control: int, target: int, **_) -> "TruthTable":
-        for row in self._bits:
-            if row[control] == 1:
-                row[target] = 1 - row[target]
-        return self
+        return self.mcx([control], target)
 
     @inplace
     def mcx(self, controls: Iterable[int], target: int, **_) -> "TruthTable":
-        for row in self._bits:
-            if all([row[control] == 1 for control in controls]):
-                row[target] = 1 - row[target]
+        mask = self._full
+        for control in controls:
+            mask &= self._planes[control]
+        self._planes[target] ^= mask
+        if self._care is not None:
+            # the result is known where a control is a known 0 or all controls are known 1s
+            known_ones = self._full
+            known_zeros = 0
+            for control in controls:
+                known_ones &= self._planes[control] & self._care[control]
+                known_zeros |= ~self._planes[control] & self._care[control]
+            self._care[target] &= known_ones | known_zeros
+            self._planes[target] &= self._care[target]
         return self
 
     @inplace
     def shuffle(self, **_) -> "TruthTable":
-        assert self._bits is not None
-        new_bits = [copy(row) for row in self.bits()]
-        shuffle(new_bits)
-        self._bits = new_bits
+        order = list(range(len(self)))
+        shuffle(order)
+        return self._reorder_rows(order)
+
+    def _reorder_rows(self, order: list[int]) -> "TruthTable":
+        values = self.values()
+        self._planes = self.values_to_planes([values[r_id] for r_id in order], self._bits_num)
+        if self._care is not None:
+            care = self.planes_to_values(self._care, len(self))
+            self._care = self.values_to_planes([care[r_id] for r_id in order], self._bits_num)
         return self
 
     @inplace
     def inverse(self, **_) -> "TruthTable":
+        assert self._care is None, "Only a fully specified table can be inverted"
         values = self.values()
         inverse_values = [-1] * len(values)
         for i, p in enumerate(values):
             inverse_values[p] = i
-        self._bits = [self.value_to_row(row, self._bits_num) for row in inverse_values]
+        self._planes = self.values_to_planes(inverse_values, self._bits_num)
         return self
 
     @inplace
@@ -115,15 +192,20 @@ class TruthTable:
         assert len(permutation) == self._bits_num
         assert sorted(permutation) == list(range(self._bits_num))
 
+        new_planes = [0] * self._bits_num
+        for i, plane in enumerate(self._planes):
+            new_planes[permutation[i]] = plane
+        self._planes = new_planes
+        if self._care is not None:
+            new_care = [0] * self._bits_num
+            for i, plane in enumerate(self._care):
+                new_care[permutation[i]] = plane
+            self._care = new_care
+
         if permute_input:
             reordering = TruthTable(self._bits_num).permute(permutation, False).values()
-        else:
-            reordering = list(range(2**self._bits_num))
-
-        new_bits = [[0] * self._bits_num for _ in range(len(self))]
-        for i in range(self._bits_num):
-            new_i = permutation[i]
-            for r_id, row in enumerate(self._bits):
-                new_bits[reordering[r_id]][new_i] = row[i]
-        self._bits = new_bits
+            order = [0] * len(self)
+            for r_id, new_r_id in enumerate(reordering):
+                order[new_r_id] = r_id
+            self._reorder_rows(order)
         return self
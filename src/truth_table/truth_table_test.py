@@ -166,3 +166,42 @@ def test_permutation_with_input():
     exp_tt_with = [4, 5, 6, 7, 1, 2, 3, 0]
     assert tt.permute(permutation, False, inplace=False).values() == exp_tt_without
     assert tt.permute(permutation, True, inplace=False).values() == exp_tt_with
+
+
+@pytest.mark.parametrize("bits_num", bits_num_randomizer)
+def test_planes(random_tt):
+    bits_num = random_tt.bits_num()
+    values = random_tt.values()
+    planes = random_tt.planes()
+    assert len(planes) == bits_num
+    for r_id, value in enumerate(values):
+        assert random_tt[r_id] == TruthTable.value_to_row(value, bits_num)
+        for i, plane in enumerate(planes):
+            assert (plane >> r_id) & 1 == (value >> i) & 1
+    assert TruthTable(bits_num, bits=random_tt.bits()) == random_tt
+    assert TruthTable.planes_to_values(planes, len(random_tt)) == values
+
+
+@pytest.mark.parametrize("bits_num", bits_num_randomizer)
+def test_partial(random_tt, mcx_params, random_permutations):
+    bits_num = random_tt.bits_num()
+    bits = [[b if randint(0, 3) else -1 for b in row] for row in random_tt.bits()]
+    tt = TruthTable(bits_num, bits=bits)
+    assert tt.bits() == bits and tt[-1] == bits[-1]
+    assert tt.complete() == all(b != -1 for row in bits for b in row)
+    assert tt.matches(random_tt) and random_tt.matches(tt)
+
+    permutation, inv_permutation = random_permutations
+    assert tt.permute(permutation, inplace=False).permute(inv_permutation) == tt
+
+    controls, target = mcx_params
+    result = tt.mcx(controls, target, inplace=False)
+    for row, new_row in zip(bits, result.bits()):
+        known = row[target] != -1 and (
+            any(row[c] == 0 for c in controls) or all(row[c] == 1 for c in controls)
+        )
+        if not known:
+            assert new_row[target] == -1
+        else:
+            assert new_row[target] == row[target] ^ all(row[c] == 1 for c in controls)
+    assert result.matches(random_tt.mcx(controls, target, inplace=False))
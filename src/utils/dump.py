@@ -1,5 +1,19 @@
-from circuit.circuit import Circuit, Gate
+from array import array
+from io import StringIO
+from struct import Struct
+from sys import byteorder
+from typing import BinaryIO, TextIO
+from circuit.circuit import Circuit, Gate, gates_typecode
 from circuit.collection import Collection
+from circuit.dim_group import DimGroup
+from utils.stream import open_text
+
+
+BIN_MAGIC = b"RSC1"
+BIN_HEADER = Struct("<4sHH")  # magic, max_width, max_gate_count
+BIN_GROUP = Struct("<QQ")  # offset of the first gate, circuits number
+SHARD_MAGIC = b"RSD1"
+SHARD_HEADER = Struct("<4sHHQ")  # magic, width, gate count, circuits number
 
 
 def gate_dump_str(gate: Gate) -> str:
@@ -10,21 +24,73 @@ def gate_dump_str(gate: Gate) -> str:
     return gate_str
 
 
-def circuit_dump_str(circuit: Circuit) -> str:
-    circuit_str = f"c {circuit.width()} {len(circuit)}\n"
-    for gate in circuit.gates():
-        circuit_str += gate_dump_str(gate) + "\n"
-    return circuit_str
+def write_circuit(file: TextIO, circuit: Circuit) -> None:
+    file.write(f"c {circuit.width()} {len(circuit)}\n")
+    file.writelines(gate_dump_str(gate) + "\n" for gate in circuit.gates())
 
 
-def collection_dump_str(collection: Collection) -> str:
+def write_dimgroup(file: TextIO, dimgroup: DimGroup) -> None:
+    for circuit in dimgroup:
+        write_circuit(file, circuit)
+        file.write("\n")
+
+
+def write_collection(file: TextIO, collection: Collection) -> None:
     mw = collection._max_width
     mgc = collection._max_gate_count
-    collection_str = f"h {mw} {mgc}\n\n"
+    file.write(f"h {mw} {mgc}\n\n")
     for w in range(mw + 1):
         for gc in range(mgc + 1):
-            for circuit in collection[w][gc]:
-                circuit_str = circuit_dump_str(circuit)
-                collection_str += circuit_str + "\n"
+            write_dimgroup(file, collection[w][gc])
+
+
+def collection_dump(collection: Collection, file_name: str) -> None:
+    with open_text(file_name, "w") as file:
+        write_collection(file, collection)
+
+
+def circuit_dump_str(circuit: Circuit) -> str:
+    buffer = StringIO()
+    write_circuit(buffer, circuit)
+    return buffer.getvalue()
+
+
+def collection_dump_str(collection: Collection) -> str:
+    buffer = StringIO()
+    write_collection(buffer, collection)
+    return buffer.getvalue()
+
+
+def group_gate_size(width: int) -> int:
+    return array(gates_typecode(width)).itemsize
+
+
+def collection_dump_bin(collection: Collection, file_name: str) -> None:
+    mw = collection._max_width
+    mgc = collection._max_gate_count
+    offset = BIN_HEADER.size + (mw + 1) * (mgc + 1) * BIN_GROUP.size
+    with open(file_name, "wb") as file:
+        file.write(BIN_HEADER.pack(BIN_MAGIC, mw, mgc))
+        for w in range(mw + 1):
+            for gc in range(mgc + 1):
+                circuits_num = len(collection[w][gc])
+                file.write(BIN_GROUP.pack(offset, circuits_num))
+                offset += circuits_num * gc * group_gate_size(w)
+        for w in range(mw + 1):
+            for gc in range(mgc + 1):
+                write_packed(file, collection[w][gc])
+
+
+def dimgroup_dump_bin(dimgroup: DimGroup, file_name: str) -> None:
+    with open(file_name, "wb") as file:
+        header = (SHARD_MAGIC, dimgroup._width, dimgroup._gate_count, len(dimgroup))
+        file.write(SHARD_HEADER.pack(*header))
+        write_packed(file, dimgroup)
+
 
-    return collection_str
+def write_packed(file: BinaryIO, dimgroup: DimGroup) -> None:
+    for circuit in dimgroup:
+        gates = array(gates_typecode(dimgroup._width), circuit.packed_gates())
+        if byteorder == "big":
+            gates.byteswap()
+        file.write(gates.tobytes())
@@ -0,0 +1,104 @@
+from array import array
+from mmap import mmap, ACCESS_READ
+from sys import byteorder
+from circuit.circuit import Circuit, gates_typecode
+from circuit.collection import Collection
+from circuit.dim_group import DimGroup
+from utils.dump import BIN_MAGIC, BIN_HEADER, BIN_GROUP, SHARD_MAGIC, SHARD_HEADER
+from utils.dump import group_gate_size
+
+
+class MappedDimGroup:
+    def __init__(self, buffer: mmap, width: int, gate_count: int, offset: int, size: int):
+        self._buffer = buffer
+        self._width = width
+        self._gate_count = gate_count
+        self._offset = offset
+        self._size = size
+        self._circuit_bytes = gate_count * group_gate_size(width)
+
+    def __len__(self) -> int:
+        return self._size
+
+    def __bool__(self) -> bool:
+        return self._size > 0
+
+    def __getitem__(self, key: int) -> Circuit:
+        if not -self._size <= key < self._size:
+            raise IndexError("MappedDimGroup index out of range")
+        start = self._offset + (key % self._size) * self._circuit_bytes
+        gates = array(gates_typecode(self._width))
+        gates.frombytes(self._buffer[start:start + self._circuit_bytes])
+        if byteorder == "big":
+            gates.byteswap()
+        return Circuit.from_packed(self._width, gates)
+
+    def __iter__(self):
+        for i in range(self._size):
+            yield self[i]
+
+    def to_dimgroup(self) -> DimGroup:
+        dimgroup = DimGroup(self._width, self._gate_count)
+        dimgroup.extend(self)
+        return dimgroup
+
+
+class MappedCollection:
+    def __init__(self, file_name: str):
+        with open(file_name, "rb") as file:
+            self._buffer = mmap(file.fileno(), 0, access=ACCESS_READ)
+        magic, max_width, max_gate_count = BIN_HEADER.unpack_from(self._buffer, 0)
+        if magic != BIN_MAGIC:
+            self._buffer.close()
+            raise ValueError(f"{file_name} is not a binary collection file")
+        self._max_width = max_width
+        self._max_gate_count = max_gate_count
+        self._groups = []
+        entry = BIN_HEADER.size
+        for width in range(max_width + 1):
+            groups = []
+            for gc in range(max_gate_count + 1):
+                offset, size = BIN_GROUP.unpack_from(self._buffer, entry)
+                groups.append(MappedDimGroup(self._buffer, width, gc, offset, size))
+                entry += BIN_GROUP.size
+            self._groups.append(groups)
+
+    def __len__(self) -> int:
+        return len(self._groups)
+
+    def __getitem__(self, key: int) -> list[MappedDimGroup]:
+        return self._groups[key]
+
+    def __enter__(self) -> "MappedCollection":
+        return self
+
+    def __exit__(self, *_) -> None:
+        self.close()
+
+    def close(self) -> None:
+        self._buffer.close()
+
+    def to_collection(self) -> Collection:
+        collection = Collection(self._max_width, self._max_gate_count)
+        for width, groups in enumerate(self._groups):
+            for gc, group in enumerate(groups):
+                collection[width][gc] = group.to_dimgroup()
+        return collection
+
+
+def dimgroup_load_bin(file_name: str) -> DimGroup:
+    with open(file_name, "rb") as file:
+        header = file.read(SHARD_HEADER.size)
+        if len(header) < SHARD_HEADER.size or header[:4] != SHARD_MAGIC:
+            raise ValueError(f"{file_name} is not a binary dim group file")
+        _, width, gate_count, size = SHARD_HEADER.unpack(header)
+        gates = array(gates_typecode(width))
+        gates.frombytes(file.read())
+    if len(gates) != size * gate_count:
+        raise ValueError(f"{file_name} is truncated")
+    if byteorder == "big":
+        gates.byteswap()
+    dimgroup = DimGroup(width, gate_count)
+    for i in range(size):
+        dimgroup.append(Circuit.from_packed(width, gates[i * gate_count:(i + 1) * gate_count]))
+    return dimgroup
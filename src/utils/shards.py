@@ -0,0 +1,58 @@
+import json
+import os
+from hashlib import sha256
+from os.path import basename, exists, join
+from circuit.dim_group import DimGroup
+from utils.dump import dimgroup_dump_bin
+from utils.load import dimgroup_load_bin
+
+
+def file_sha256(file_name: str) -> str:
+    digest = sha256()
+    with open(file_name, "rb") as file:
+        while chunk := file.read(1 << 20):
+            digest.update(chunk)
+    return digest.hexdigest()
+
+
+class ShardStore:
+    def __init__(self, dir: str, collection_name: str):
+        self._dir = dir
+        self._collection_name = collection_name
+        self._manifest_path = join(dir, f"{collection_name}.manifest.json")
+        self._shards: dict[str, dict] = {}
+        if exists(self._manifest_path):
+            with open(self._manifest_path) as file:
+                self._shards = json.load(file)["shards"]
+
+    def __contains__(self, key: tuple[int, int]) -> bool:
+        return self.load(*key) is not None
+
+    def shard_path(self, width: int, gate_count: int) -> str:
+        return join(self._dir, f"{self._collection_name}_{width}_{gate_count}.bin")
+
+    def load(self, width: int, gate_count: int) -> DimGroup | None:
+        entry = self._shards.get(f"{width}_{gate_count}")
+        path = self.shard_path(width, gate_count)
+        if entry is None or not exists(path) or file_sha256(path) != entry["sha256"]:
+            return None
+        dimgroup = dimgroup_load_bin(path)
+        if (dimgroup._width, dimgroup._gate_count, len(dimgroup)) != (
+            width, gate_count, entry["circuits"]
+        ):
+            return None
+        return dimgroup
+
+    def save(self, dimgroup: DimGroup) -> None:
+        path = self.shard_path(dimgroup._width, dimgroup._gate_count)
+        dimgroup_dump_bin(dimgroup, path + ".tmp")
+        digest = file_sha256(path + ".tmp")
+        os.replace(path + ".tmp", path)
+        entry = {"file": basename(path), "circuits": len(dimgroup), "sha256": digest}
+        self._shards[f"{dimgroup._width}_{dimgroup._gate_count}"] = entry
+        self._write_manifest()
+
+    def _write_manifest(self) -> None:
+        with open(self._manifest_path + ".tmp", "w") as file:
+            json.dump({"shards": self._shards}, file, indent=2, sort_keys=True)
+        os.replace(self._manifest_path + ".tmp", self._manifest_path)
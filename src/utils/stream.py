@@ -0,0 +1,36 @@
+import gzip
+from collections.abc import Iterable, Iterator
+from typing import TextIO
+from circuit.circuit import Circuit
+
+
+def open_text(file_name: str, mode: str = "r") -> TextIO:
+    assert mode in ("r", "w", "a")
+    if file_name.endswith(".gz"):
+        return gzip.open(file_name, mode + "t")
+    return open(file_name, mode)
+
+
+def read_circuits(
+    lines: Iterable[str],
+    max_width: int | None = None,
+    max_gate_count: int | None = None,
+) -> Iterator[Circuit]:
+    lines = iter(lines)
+    for line in lines:
+        match line.split():
+            case ["h", width, gc]:
+                assert max_width is None or int(width) == max_width
+                assert max_gate_count is None or int(gc) == max_gate_count
+            case ["c", width, gc]:
+                width = int(width)
+                gc = int(gc)
+                assert max_width is None or width <= max_width
+                assert max_gate_count is None or gc <= max_gate_count
+                circuit = Circuit(width)
+                for _ in range(gc):
+                    target, *controls = next(lines).split()
+                    circuit.mcx([int(c) for c in controls], int(target))
+                yield circuit
+            case _:
+                pass